@@ -13,9 +13,41 @@ METADATA_FILE_SHEETS_YEARS = [2021, 2023]
 UPPER_TOLERANCE_MOISTURE = 50
 LOWER_TOLERANCE_MOISTURE = 10
 
+# Quality control checks on the raw readings besides the tolerance range; None disables a check.
+# Readings further than QC_SPIKE_THRESHOLD from the rolling median of QC_SPIKE_WINDOW readings
+QC_SPIKE_THRESHOLD = None
+QC_SPIKE_WINDOW = 5
+# Readings changing faster than QC_MAX_RATE_OF_CHANGE (moisture % per hour) since the previous one
+QC_MAX_RATE_OF_CHANGE = None
+# Runs of at least QC_FLATLINE_LENGTH identical readings (stuck sensor)
+QC_FLATLINE_LENGTH = None
+# Save the QC flags of every raw reading in a 'qc' folder next to the averaged data
+QC_WRITE_FLAGS = False
+
+# Formats to save the processed data in: any of 'csv', 'parquet' and 'feather'.
+# Parquet and Feather need the pyarrow package.
+OUTPUT_FILE_FORMATS = ['csv']
+
+# Watch mode: seconds between polls of INDIR, and seconds a raw file must be left unmodified
+# before it is processed, so that files still being written are not read half-way
+WATCH_INTERVAL = 10
+WATCH_SETTLE = 30
+
 
 #------------------------------------------
 #------------- Data Reader ----------------
 #------------------------------------------
 
 SMS_PATH = 'F:\\WIT-SMS\\test_data\\processed\\daily'
+
+#------------------------------------------
+#------------ Query Service ---------------
+#------------------------------------------
+
+# Address of witsms_service.py; the default only accepts connections from this machine
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+# Number of answers kept in the response cache
+SERVICE_CACHE_SIZE = 1024
+# Seconds between checks of the served folder for changed files
+SERVICE_CHECK_INTERVAL = 5
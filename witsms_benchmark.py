@@ -0,0 +1,285 @@
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource  # not available on Windows, where peak RSS is not recorded
+except ImportError:
+    resource = None
+
+# Raw logger file layout
+PREAMBLE = "Observation Point Name,,,\nStart Date of Record,,,\nEnd Date of Record,,,\n,,,\n"
+
+# Metadata workbook columns, as in test_data/metadata.xlsx
+METADATA_COLUMNS = ["Sr No.", "Device", "Measuring\n Capabilities", "Depth in\n Inches", "Type of\n Sensor",
+                    "Date Of \nDeployment", "Date Of \nRemoval", "Location", "Latitude", "Longitude", "Deployment ID"]
+
+# Logger timestamp formats: 12-hour with seconds and lowercase am/pm, and 24-hour without seconds
+TIMESTAMP_FORMAT_12H = '%m/%d/%Y %I:%M:%S %p'
+TIMESTAMP_FORMAT_24H = '%m/%d/%Y %H:%M'
+
+# Stages timed by the benchmark, in the order they are run
+STAGES = ['prepare_dataframes', 'aggregate', 'process_three_formats', 'preprocess', 'read_data']
+
+FIRST_YEAR = 2021
+
+
+def raw_station_frame(start, days, rng, timestamp_format):
+    """
+    Generates the rows of one raw logger file.
+
+    Args:
+        start (pd.Timestamp): The time of the first reading.
+        days (int): The number of days covered, before gaps are cut out.
+        rng (np.random.Generator): The random generator.
+        timestamp_format (str): '12h', '24h' or 'mixed' (the logger switches from 12h to 24h halfway).
+
+    Returns:
+        pd.DataFrame: The rows with the raw columns, timestamps already formatted.
+    """
+    # Readings about every 20 minutes, with jitter
+    steps = rng.normal(20, 1.5, size=days * 72).clip(15, 25)
+    times = start + pd.to_timedelta(np.cumsum(steps).round(), unit='min')
+    keep = np.ones(len(times), dtype=bool)
+    # Outages of half a day to five days
+    for _ in range(rng.integers(0, 4)):
+        first = rng.integers(0, len(times))
+        keep[first:first + rng.integers(36, 360)] = False
+    times = times[keep]
+    n = len(times)
+
+    hours = np.asarray(times.hour + times.minute / 60)
+    vwc1 = rng.uniform(18, 40) + np.cumsum(rng.normal(0, 0.05, n)) + 1.5 * np.sin(2 * np.pi * hours / 24)
+    vwc1 += rng.normal(0, 0.2, n)
+    spikes = rng.random(n) < 0.005  # out of tolerance readings
+    vwc1[spikes] = np.where(rng.random(spikes.sum()) < 0.5, rng.uniform(0, 9, spikes.sum()), rng.uniform(55, 100, spikes.sum()))
+    vwc1[rng.random(n) < 0.02] = np.nan
+    if rng.random() < 0.5:  # second sensor
+        vwc2 = vwc1 + rng.normal(1, 0.5, n)
+        vwc2[rng.random(n) < 0.05] = np.nan
+    else:
+        vwc2 = np.full(n, np.nan)
+
+    if timestamp_format == '12h':
+        stamps = times.strftime(TIMESTAMP_FORMAT_12H).str.lower()
+    elif timestamp_format == '24h':
+        stamps = times.strftime(TIMESTAMP_FORMAT_24H)
+    else:
+        half = n // 2
+        stamps = times[:half].strftime(TIMESTAMP_FORMAT_12H).str.lower().append(times[half:].strftime(TIMESTAMP_FORMAT_24H))
+
+    df = pd.DataFrame({
+        "TimeStamp": stamps,
+        "MeasuredRange": rng.integers(150, 200, n),
+        "VolumetricWaterContent1": vwc1.round(4),
+        "VolumetricWaterContent2": vwc2.round(4),
+    })
+    if timestamp_format == '24h':
+        df = df.iloc[::-1]  # some loggers export the newest reading first
+    return df
+
+def write_raw_file(file_path, df):
+    """
+    Writes raw rows with the 4-line preamble and header of the logger exports.
+    """
+    with open(file_path, 'w', newline='') as f:
+        f.write(PREAMBLE)
+        df.to_csv(f, index=False, header=True, na_rep='')
+
+def generate_network(root, stations, years=1, days=30, seed=0):
+    """
+    Generates a synthetic WIT-SMS network: raw logger files for every station and year under
+    root/raw/<year>, and a metadata workbook root/metadata.xlsx with one sheet per year.
+
+    Args:
+        root (str): The folder to generate the network in.
+        stations (int): The number of stations per year.
+        years (int): The number of years, starting from 2021.
+        days (int): The number of days of readings per station and year.
+        seed (int): The random seed.
+
+    Returns:
+        dict: The metadata file path, the years, the raw data folders and the number of raw rows.
+    """
+    rng = np.random.default_rng(seed)
+    year_list = [FIRST_YEAR + y for y in range(years)]
+    data_file_paths = []
+    rows = 0
+    metadata_path = os.path.join(root, "metadata.xlsx")
+    os.makedirs(root, exist_ok=True)
+    with pd.ExcelWriter(metadata_path) as writer:
+        for year in year_list:
+            folder = os.path.join(root, "raw", str(year))
+            os.makedirs(folder, exist_ok=True)
+            data_file_paths.append(folder)
+            metadata = []
+            for sr in range(1, stations + 1):
+                start = pd.Timestamp(year=year, month=1, day=1) + pd.Timedelta(minutes=int(rng.integers(0, 1440)))
+                df = raw_station_frame(start, days, rng, ['12h', '24h', 'mixed'][sr % 3])
+                write_raw_file(os.path.join(folder, f"{sr}_ bench _ farm{sr}.csv"), df)
+                rows += len(df)
+                metadata.append([sr, "Soil Moisture Sensor", "Soil Moisture", "6", "Capacitance",
+                                 pd.Timestamp(year=year, month=1, day=1), None, f"Bench Farm {sr}",
+                                 round(rng.uniform(24, 37), 7), round(rng.uniform(61, 77), 7), "bench"])
+            pd.DataFrame(metadata, columns=METADATA_COLUMNS).to_excel(writer, sheet_name=str(year), index=False)
+    return {'metadata_file_path': metadata_path, 'years': year_list, 'data_file_paths': data_file_paths, 'rows': rows}
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the current process in MB, or None where unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def run_stage(stage, network, outdir):
+    """
+    Times one stage over a generated network. Runs in a fresh process so that earlier stages do
+    not count towards its peak RSS. The peak is of the whole process, so it includes the imports
+    and the data the stage is given, e.g. the network read by prepare_dataframes() before
+    aggregate is timed; the peak reached by then is reported as the setup RSS.
+
+    Returns:
+        dict: The stage, wall time in seconds, setup and peak RSS in MB, rows and rows per second.
+    """
+    import witsms_processing as wp
+    from witsms_reader import SoilMoistureData
+    wp.OUTDIR = outdir
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage in ('aggregate', 'process_three_formats'):
+            dataframes = wp.prepare_dataframes(network['data_file_paths'])
+            metadata = wp.prepare_metadata(network['metadata_file_path'], network['years'])
+        rows = network['rows']
+        setup_rss_mb = peak_rss_mb()
+
+        start = time.perf_counter()
+        if stage == 'prepare_dataframes':
+            wp.prepare_dataframes(network['data_file_paths'])
+        elif stage == 'aggregate':
+            for year_dataframes in dataframes:
+                for df in year_dataframes:
+                    wp.aggregate(df)
+        elif stage == 'process_three_formats':
+            for i, year_dataframes in enumerate(dataframes):
+                for j, df in enumerate(year_dataframes):
+                    wp.process_three_formats(df, metadata[i].iloc[j], network['years'][i])
+        elif stage == 'preprocess':
+            wp.preprocess(network['metadata_file_path'], network['years'], network['data_file_paths'], full=True)
+        elif stage == 'read_data':
+            data = SoilMoistureData(os.path.join(outdir, wp.get_resolution('30minute').folder))
+            data.read_data()
+            rows = sum(len(timestamps) for timestamps, _ in data.data)
+        else:
+            raise ValueError(f"Unknown benchmark stage: {stage}")
+        seconds = time.perf_counter() - start
+
+    return {'stage': stage, 'seconds': seconds, 'setup_rss_mb': setup_rss_mb, 'peak_rss_mb': peak_rss_mb(), 'rows': rows,
+            'rows_per_second': rows / seconds if seconds else None}
+
+def run_benchmark(scales, years=1, days=30, seed=0, stages=STAGES, workdir=None):
+    """
+    Generates a network at every scale and times each stage on it.
+
+    Args:
+        scales (list): The numbers of stations to benchmark, e.g. [10, 200, 2000].
+        years (int): The number of years per network.
+        days (int): The number of days of readings per station and year.
+        seed (int): The random seed of the generator.
+        stages (list): The stages to time, from STAGES. read_data needs the outputs of preprocess.
+        workdir (str): The folder to generate the networks in; a temporary folder if None,
+                       removed afterwards.
+
+    Returns:
+        dict: The settings, environment and one result per scale and stage.
+    """
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'settings': {'scales': list(scales), 'years': years, 'days': days, 'seed': seed, 'stages': list(stages)},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'pandas': pd.__version__, 'numpy': np.__version__, 'cpus': os.cpu_count()},
+        'results': [],
+    }
+    root = workdir or tempfile.mkdtemp(prefix='witsms_benchmark_')
+    context = multiprocessing.get_context('spawn')
+    try:
+        for stations in scales:
+            scale_root = os.path.join(root, f"stations_{stations}")
+            shutil.rmtree(scale_root, ignore_errors=True)
+            print(f"GENERATING NETWORK... {stations} stations x {years} years x {days} days")
+            network = generate_network(scale_root, stations, years, days, seed)
+            outdir = os.path.join(scale_root, "processed")
+            for stage in stages:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_stage, stage, network, outdir).result()
+                result = dict(stations=stations, years=years, **result)
+                report['results'].append(result)
+                print(f"  {stage:<22} {result['seconds']:9.3f} s  {result['rows_per_second'] or 0:12,.0f} rows/s"
+                      f"  {result['peak_rss_mb'] or 0:9.1f} MB peak  {result['setup_rss_mb'] or 0:9.1f} MB after setup")
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+def compare_reports(previous, current, threshold=0.2):
+    """
+    Compares the wall times of two benchmark reports.
+
+    Args:
+        previous (dict): The earlier report.
+        current (dict): The new report.
+        threshold (float): The relative slowdown reported as a regression.
+
+    Returns:
+        list: (stations, stage, previous seconds, current seconds) for every regression.
+    """
+    before = {(r['stations'], r['stage']): r['seconds'] for r in previous['results']}
+    regressions = []
+    for r in current['results']:
+        old = before.get((r['stations'], r['stage']))
+        if old and r['seconds'] > old * (1 + threshold):
+            regressions.append((r['stations'], r['stage'], old, r['seconds']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the processing and reading of soil moisture data on a synthetic network.')
+    parser.add_argument('--stations', type=int, nargs='+', default=[10, 200, 2000], help='Numbers of stations to benchmark')
+    parser.add_argument('--years', type=int, default=1, help='Number of years per network')
+    parser.add_argument('--days', type=int, default=30, help='Days of readings per station and year')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generator')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages to time')
+    parser.add_argument('--workdir', default=None, help='Folder to keep the generated networks in; a temporary folder otherwise')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to save the results to')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.stations, args.years, args.days, args.seed, args.stages, args.workdir)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("RESULTS SAVED:", args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare_reports(previous, report, args.threshold)
+        for stations, stage, old, new in regressions:
+            print(f"REGRESSION: {stage} at {stations} stations took {new:.3f} s, was {old:.3f} s")
+        if not regressions:
+            print("NO REGRESSIONS")
@@ -0,0 +1,188 @@
+import os
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+# Counters kept for every stage of a station
+RECORD_FIELDS = ['station', 'stage', 'resolution', 'calls', 'seconds', 'rows_in', 'rows_out', 'bytes']
+
+# The Recorder collecting stage counters in this process, or None when instrumentation is off
+_active = None
+
+
+class Recorder:
+    """
+    Collects the counters of the stages run for one station. Repeated stages, e.g. one per chunk
+    of a file read in chunks, are added up into a single record.
+    """
+    def __init__(self, station=None):
+        self.station = station
+        self._records = {}
+
+    def add(self, stage, resolution, seconds, rows_in, rows_out, nbytes):
+        key = (stage, resolution)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = {'station': self.station, 'stage': stage, 'resolution': resolution,
+                                           'calls': 0, 'seconds': 0.0, 'rows_in': None, 'rows_out': None, 'bytes': None}
+        record['calls'] += 1
+        record['seconds'] += seconds
+        for field, value in (('rows_in', rows_in), ('rows_out', rows_out), ('bytes', nbytes)):
+            if value is not None:
+                record[field] = (record[field] or 0) + int(value)
+
+    @property
+    def records(self):
+        return list(self._records.values())
+
+
+class _Stage:
+    """Times one stage; rows_in, rows_out and bytes may be set inside the with block."""
+    __slots__ = ('recorder', 'name', 'resolution', 'rows_in', 'rows_out', 'bytes', 'start')
+
+    def __init__(self, recorder, name, resolution, rows_in):
+        self.recorder = recorder
+        self.name = name
+        self.resolution = resolution
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.add(self.name, self.resolution, time.perf_counter() - self.start, self.rows_in, self.rows_out, self.bytes)
+        return False
+
+
+class _NullStage:
+    """Stands in for _Stage when instrumentation is off; ignores everything set on it."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+NULL_STAGE = _NullStage()
+
+
+def enabled():
+    """Returns True if stages are being recorded in this process."""
+    return _active is not None
+
+def stage(name, resolution=None, rows_in=None):
+    """
+    Returns a context manager timing one stage of the station being recorded, or a shared no-op
+    one when instrumentation is off, so that instrumented code costs next to nothing by default.
+
+    Args:
+        name (str): The stage name, e.g. 'read' or 'accumulate'.
+        resolution (str): The averaging interval the stage works on, if any.
+        rows_in (int): The number of rows going into the stage.
+    """
+    if _active is None:
+        return NULL_STAGE
+    return _Stage(_active, name, resolution, rows_in)
+
+@contextmanager
+def recording(station=None):
+    """
+    Records the stages run inside the with block for a station, yielding its Recorder.
+    """
+    global _active
+    previous, _active = _active, Recorder(station)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+class RunReport:
+    """
+    Gathers the stage records of a processing run, passes each one to the hooks as it arrives,
+    and saves them as a JSON or CSV report.
+
+    Args:
+        hooks (list): Callables receiving every record, a dict with the RECORD_FIELDS, e.g. to
+                      forward the counters to a monitoring system.
+    """
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.records = []
+
+    def add(self, records):
+        for record in records:
+            self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    @contextmanager
+    def recording(self, station=None):
+        """Records the stages run in this process inside the with block into the report."""
+        with recording(station) as recorder:
+            try:
+                yield recorder
+            finally:
+                self.add(recorder.records)
+
+    def station_totals(self):
+        """
+        Returns one summary per station: total seconds, raw rows read, rows left after the
+        outlier removal, bytes written and the slowest stage.
+        """
+        totals = {}
+        for record in self.records:
+            if record['station'] is None:
+                continue
+            total = totals.setdefault(record['station'], {'station': record['station'], 'seconds': 0.0, 'rows_read': 0,
+                                                          'rows_cleaned': 0, 'bytes': 0, 'slowest_stage': None, 'slowest_seconds': 0.0})
+            total['seconds'] += record['seconds']
+            if record['stage'] == 'read':
+                total['rows_read'] += record['rows_out'] or 0
+            elif record['stage'] in ('remove_outliers_and_nan', 'quality_control'):
+                total['rows_cleaned'] += record['rows_out'] or 0
+            elif record['stage'] == 'write':
+                total['bytes'] += record['bytes'] or 0
+            if record['seconds'] > total['slowest_seconds']:
+                label = record['stage'] + (f"[{record['resolution']}]" if record['resolution'] else "")
+                total['slowest_stage'], total['slowest_seconds'] = label, record['seconds']
+        return list(totals.values())
+
+    def slowest_stations(self, n=10):
+        return sorted(self.station_totals(), key=lambda total: total['seconds'], reverse=True)[:n]
+
+    def print_summary(self, n=10):
+        """Prints a table of the n slowest stations."""
+        stations = self.slowest_stations(n)
+        if not stations:
+            return
+        print(f"SLOWEST STATIONS ({len(stations)} / {len(self.station_totals())}):")
+        print(f"  {'station':<40} {'seconds':>9} {'rows read':>10} {'rows kept':>10} {'bytes':>12}  slowest stage")
+        for total in stations:
+            print(f"  {total['station']:<40} {total['seconds']:9.3f} {total['rows_read']:10d} {total['rows_cleaned']:10d}"
+                  f" {total['bytes']:12d}  {total['slowest_stage']} ({total['slowest_seconds']:.3f} s)")
+
+    def save(self, path):
+        """
+        Saves the report: every stage record as rows of a .csv file, or the records and the
+        per-station totals as a .json file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'stations': self.station_totals(), 'records': self.records}, f, indent=1)
@@ -0,0 +1,167 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+# Default number of points drawn per series in batch plots
+DEFAULT_MAX_POINTS = 2000
+
+# Rows and columns of station panels on an overview sheet
+OVERVIEW_GRID = (5, 4)
+
+
+def lttb(x, y, n_out):
+    """
+    Selects n_out points of a series with the Largest-Triangle-Three-Buckets algorithm, which keeps
+    the visual shape of the series (peaks, drops) much better than taking every k-th point.
+    The first and last points are always kept; every bucket in between contributes the point that
+    forms the largest triangle with the point kept from the previous bucket and the mean of the next.
+
+    Args:
+        x: 1-D float array of increasing x values.
+        y: 1-D float array of y values.
+        n_out: The number of points to keep.
+
+    Returns:
+        np.ndarray: The sorted indices of the points kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    edges = (np.arange(n_out - 1) * every).astype('int64') + 1
+    edges[-1] = n - 1
+    kept = np.empty(n_out, dtype='int64')
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+def downsample(timestamps, values, max_points):
+    """
+    Returns a time series reduced to at most max_points points by lttb(); None keeps every point.
+    """
+    if max_points is None or len(timestamps) <= max_points:
+        return timestamps, values
+    x = (timestamps - timestamps[0]).astype('timedelta64[ns]').astype('int64').astype('float64')
+    kept = lttb(x, np.asarray(values, dtype='float64'), max_points)
+    return timestamps[kept], values[kept]
+
+def draw_station(ax, timestamps, values, meta, small=False):
+    """
+    Draws one station's series on an axes, labelled like SoilMoistureData.plot_data_gpi().
+    """
+    ax.plot(timestamps, values, linewidth=0.8 if small else 1.5,
+            label=f"GPI {meta['gpi']} at ({meta['latitude']}, {meta['longitude']})")
+    if small:
+        ax.set_title(f"GPI {meta['gpi']}", fontsize=8)
+        locator = AutoDateLocator(maxticks=5)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+        ax.tick_params(labelsize=6)
+        ax.xaxis.get_offset_text().set_fontsize(6)
+    else:
+        ax.set_title(f"Soil Moisture Time Series for GPI {meta['gpi']} - Values: {meta['count']}")
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Soil Moisture')
+        ax.legend()
+
+def render_station(job):
+    """
+    Renders one station's plot to a file. Runs in a worker process; figures are created without
+    pyplot, so no window or interactive backend is involved.
+
+    Args:
+        job (tuple): The timestamps, soil moistures, metadata entry, output path and max_points.
+
+    Returns:
+        tuple: The output path and the downsampled series with its metadata entry, reused for
+               the overview sheets.
+    """
+    timestamps, values, meta, out_path, max_points = job
+    timestamps, values = downsample(timestamps, values, max_points)
+    fig = Figure(figsize=(10, 6))
+    draw_station(fig.add_subplot(), timestamps, values, meta)
+    fig.savefig(out_path)
+    return out_path, (timestamps, values, meta)
+
+def render_overview(job):
+    """
+    Renders a sheet of small station panels to a file. Runs in a worker process.
+
+    Args:
+        job (tuple): A list of (timestamps, soil moistures, metadata entry) per panel, the output
+                     path and the (rows, columns) of the grid.
+
+    Returns:
+        str: The output path.
+    """
+    panels, out_path, (rows, columns) = job
+    rows = min(rows, -(-len(panels) // columns))  # no empty rows on a sheet that is not full
+    fig = Figure(figsize=(4 * columns, 2.5 * rows))
+    axes = fig.subplots(rows, columns, squeeze=False, sharey=True)
+    for ax, (timestamps, values, meta) in zip(axes.flat, panels):
+        draw_station(ax, timestamps, values, meta, small=True)
+    for ax in axes.flat[len(panels):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    fig.savefig(out_path)
+    return out_path
+
+def run_jobs(function, jobs, workers):
+    """
+    Runs jobs serially or on a process pool, yielding the results in job order. At most twice as many
+    jobs as workers are in flight, so the series of a large network are not all held in memory at once.
+    """
+    if not workers or workers <= 1:
+        for job in jobs:
+            yield function(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for job in jobs:
+            pending.append(executor.submit(function, job))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def render_plots(stations, output_dir, file_format='png', max_points=DEFAULT_MAX_POINTS, workers=None, overview=False, grid=OVERVIEW_GRID):
+    """
+    Renders the plots of many stations to files without opening any window.
+
+    Args:
+        stations: An iterable of (name, timestamps, soil moistures, metadata entry) per station;
+                  name is the output file name without extension.
+        output_dir (str): The directory to save the plots in.
+        file_format (str): 'png' or 'svg'.
+        max_points (int): The number of points each series is downsampled to with lttb(); None keeps all.
+        workers (int): The number of worker processes; plots are rendered serially if not above 1.
+        overview (bool): Also render overview sheets of grid[0] x grid[1] station panels each.
+        grid (tuple): The rows and columns of an overview sheet.
+
+    Returns:
+        list: The paths of the files written, station plots first.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = ((timestamps, values, meta, os.path.join(output_dir, f"{name}.{file_format}"), max_points)
+            for name, timestamps, values, meta in stations)
+    written, panels = [], []
+    for out_path, panel in run_jobs(render_station, jobs, workers):
+        written.append(out_path)
+        if overview:
+            panels.append(panel)
+    if overview:
+        per_sheet = grid[0] * grid[1]
+        sheets = [(panels[i:i + per_sheet], os.path.join(output_dir, f"overview_{i // per_sheet + 1:02d}.{file_format}"), grid)
+                  for i in range(0, len(panels), per_sheet)]
+        written.extend(run_jobs(render_overview, sheets, workers))
+    return written
@@ -4,10 +4,48 @@ import numpy as np
 import re
 import os
 import csv 
+import argparse
+import json
+import hashlib
+import io
+import pickle
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 
 from config import INDIR, OUTDIR, METADATA_FILE_PATH, METADATA_FILE_SHEETS_YEARS
 from config import LOWER_TOLERANCE_MOISTURE, UPPER_TOLERANCE_MOISTURE
+from config import OUTPUT_FILE_FORMATS
+from config import WATCH_INTERVAL, WATCH_SETTLE
+from config import QC_SPIKE_THRESHOLD, QC_SPIKE_WINDOW, QC_MAX_RATE_OF_CHANGE, QC_FLATLINE_LENGTH, QC_WRITE_FLAGS
+from witsms_qc import qc_flags
+from witsms_instrumentation import stage, enabled, recording, RunReport
+from witsms_watch import FolderWatcher
+
+# Raw columns used for processing
+DATA_COLUMNS = ["TimeStamp", "VolumetricWaterContent1", "VolumetricWaterContent2"]
+
+# Known logger timestamp formats, tried in order
+TIMESTAMP_FORMATS = ['%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M']
+# Per-station detected timestamp formats, stored in OUTDIR
+TIMESTAMP_FORMAT_CACHE = 'timestamp_formats.json'
+
+# Record of the raw files processed into OUTDIR, used to skip unchanged stations
+MANIFEST_FILE = 'manifest.json'
+
+# Parsed metadata workbook, stored in OUTDIR and reused until the workbook changes
+METADATA_CACHE = 'metadata_cache.pkl'
+
+# Output file format -> file extension
+FILE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Folder in OUTDIR for the QC flags of the raw readings, and the suffix of the flag columns
+QC_FOLDER = 'qc'
+QC_FLAG_SUFFIX = '_QC'
+
+# Finest averaging interval; every registered resolution must be a multiple of it
+BASE_FREQ = '30min'
 
 
 def natural_sort(path_list):
@@ -34,6 +72,71 @@ def natural_sort(path_list):
 
   return sorted(path_list, key=get_alphanum_key)
 
+# A raw station file with its metadata row, as processed by a worker
+StationJob = namedtuple('StationJob', ['file_path', 'metadata', 'year', 'chunksize', 'formats', 'previous', 'append', 'instrument'], defaults=[False])
+
+Resolution = namedtuple('Resolution', ['freq', 'folder', 'suffix', 'offset', 'fill_gaps'])
+
+# Averaging interval -> Resolution, in output order
+RESOLUTIONS = {}
+
+def register_resolution(average, freq, folder, suffix, offset=None, fill_gaps=False):
+    """
+    Registers an averaging interval so that it is computed by aggregate() and written by write_outputs().
+
+    Args:
+        average: The name of the averaging interval, e.g. 'daily'.
+        freq: The interval width as a timedelta string, e.g. '3h'; must be a multiple of BASE_FREQ.
+        folder: The output folder for the averaged files.
+        suffix: The suffix appended to the output file names.
+        offset: Time added to the start of each interval to give its fixed timestamp, e.g. '12h'.
+        fill_gaps: Whether intervals without data are written as empty rows.
+    """
+    width = pd.Timedelta(freq)
+    if width % pd.Timedelta(BASE_FREQ):
+        raise ValueError(f"Interval {freq} of '{average}' is not a multiple of {BASE_FREQ}")
+    RESOLUTIONS[average] = Resolution(width, folder, suffix, pd.Timedelta(offset or 0), fill_gaps)
+
+# Set the time part to 12:00 PM for daily averages
+register_resolution('daily', '24h', "daily", "_24H", offset='12h')
+register_resolution('hourly', '1h', "hourly", "_1H")
+# Ensure every 3-hour interval is represented
+register_resolution('3hourly', '3h', "tri_hourly", "_3H", fill_gaps=True)
+register_resolution('30minute', '30min', "30_min", "_30m")
+
+def get_resolution(average):
+    """
+    Returns the registered Resolution of an averaging interval.
+    """
+    try:
+        return RESOLUTIONS[average]
+    except KeyError:
+        raise ValueError(f"Unknown averaging interval: {average}") from None
+
+def interval_start(timestamps, average='daily'):
+    """
+    Maps each timestamp to the fixed timestamp of the averaging interval it falls in.
+
+    Args:
+        timestamps: A pandas Series of datetimes.
+        average: The type of averaging interval ('daily', 'hourly', etc.).
+
+    Returns:
+        A pandas Series with the interval timestamp for every entry.
+    """
+    resolution = get_resolution(average)
+    return timestamps.dt.floor(resolution.freq) + resolution.offset
+
+def complete_intervals(avg_df, average):
+    """
+    Fills in the intervals missing from an averaged dataframe where the resolution requires it.
+    """
+    resolution = get_resolution(average)
+    if resolution.fill_gaps and not avg_df.empty:
+        all_times = pd.date_range(start=avg_df['TimeStamp'].min(), end=avg_df['TimeStamp'].max(), freq=resolution.freq)
+        avg_df = avg_df.set_index('TimeStamp').reindex(all_times).reset_index().rename(columns={'index': 'TimeStamp'})
+    return avg_df
+
 def accumulate(df, value_cols, timestamp_col, average='daily'):
     """
     Computes time-based averages (e.g., daily, 3hourly, hourly and 30minute) for specified value columns 
@@ -49,32 +152,11 @@ def accumulate(df, value_cols, timestamp_col, average='daily'):
         A new pandas dataframe with averages over specified intervals and fixed timestamps for each interval.
     """
     # Ensure the timestamp column is in datetime format
-    df[timestamp_col] = pd.to_datetime(df[timestamp_col])
-
-    if average == 'daily':
-        # Set the time part to 12:00 PM for daily averages
-        df['TimeStamp'] = df[timestamp_col].dt.floor('D') + pd.Timedelta(hours=12)
-
-        # Group by the new 'FixedTime' column and compute the mean for each group
-        avg_df = df.groupby('TimeStamp')[value_cols].mean().reset_index()
-
-    elif average == '3hourly':
-        df['TimeStamp'] = df[timestamp_col].dt.floor('3h')
-        avg_df = df.groupby('TimeStamp')[value_cols].mean().reset_index()
-        # Ensure every 3-hour interval is represented
-        if not avg_df.empty:
-            all_times = pd.date_range(start=avg_df['TimeStamp'].min(), end=avg_df['TimeStamp'].max(), freq='3h')
-            avg_df = avg_df.set_index('TimeStamp').reindex(all_times).reset_index().rename(columns={'index': 'TimeStamp'})
-  
-    elif average == 'hourly':
-        # Set time to every hour
-        df['TimeStamp'] = df[timestamp_col].dt.floor('h')
-        avg_df = df.groupby('TimeStamp')[value_cols].mean().reset_index()
-
-    elif average == '30minute':
-        # Set time to every thirty minutes
-        df['TimeStamp'] = df[timestamp_col].dt.floor('30min')
-        avg_df = df.groupby('TimeStamp')[value_cols].mean().reset_index()
+    timestamps = pd.to_datetime(df[timestamp_col])
+
+    keys = interval_start(timestamps, average).rename('TimeStamp')
+    avg_df = df[list(value_cols)].groupby(keys).mean().reset_index()
+    avg_df = complete_intervals(avg_df, average)
     
     # Round the averages to 3 decimal places
     for col in value_cols:
@@ -94,11 +176,69 @@ def remove_outliers_and_nan(df,val_col,upper_bound,lower_bound):
   Returns:
       A new cleaned pandas dataframe with no outliers or NaN values.
     '''
-    df_new= df.drop(df[df[val_col].isnull()].index)
-    df_new = df_new.drop(df_new[df_new[val_col] > upper_bound].index)
-    df_new = df_new.drop(df_new[df_new[val_col] < lower_bound].index)
+    with stage('remove_outliers_and_nan', rows_in=len(df)) as timing:
+        flags = qc_flags(None, df[val_col].to_numpy(dtype='float64'), lower_bound, upper_bound)
+        df_new = df[flags == 0]
+        timing.rows_out = len(df_new)
     return df_new
 
+def qc_settings():
+    '''
+    Returns the quality control checks configured besides the tolerance range, as keyword
+    arguments of qc_flags().
+    '''
+    return {
+        'spike_threshold': QC_SPIKE_THRESHOLD,
+        'spike_window': QC_SPIKE_WINDOW,
+        'max_rate': QC_MAX_RATE_OF_CHANGE,
+        'flatline_length': QC_FLATLINE_LENGTH,
+    }
+
+def neighbour_checks_enabled():
+    '''
+    Returns True if a quality control check comparing readings with their neighbours is configured.
+    '''
+    settings = qc_settings()
+    return settings['spike_threshold'] is not None or settings['max_rate'] is not None or bool(settings['flatline_length'])
+
+def station_qc_flags(df):
+    '''
+    Evaluates the quality control checks on both sensor columns of a station dataframe.
+    Args:
+      df: The pandas dataframe with TimeStamp and value columns, sorted by TimeStamp.
+    Returns:
+      A dictionary mapping each value column to the uint8 flags of its readings.
+    '''
+    epoch = df['TimeStamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    return {col: qc_flags(epoch, df[col].to_numpy(dtype='float64'), LOWER_TOLERANCE_MOISTURE, UPPER_TOLERANCE_MOISTURE, **qc_settings())
+            for col in DATA_COLUMNS[1:]}
+
+def quality_control(df, on_flags=None):
+    '''
+    Applies every quality control check to a station dataframe in one pass per sensor column,
+    with one combined flag mask per column. Rows whose first sensor reading fails any check are
+    dropped. Second sensor readings failing any check (range, spike, rate of change, flat line)
+    are blanked, so they are left out of its averages.
+    Args:
+      df: The pandas dataframe with TimeStamp and value columns.
+      on_flags: Called with the dataframe in time order and the flags of both sensor columns,
+                e.g. to save the flags without evaluating the checks a second time.
+    Returns:
+      The cleaned dataframe.
+    '''
+    value_cols = DATA_COLUMNS[1:]
+    with stage('quality_control', rows_in=len(df)) as timing:
+        if not df['TimeStamp'].is_monotonic_increasing:
+            df = df.sort_values(by='TimeStamp', kind='stable')
+        flags = station_qc_flags(df)
+        if on_flags is not None:
+            on_flags(df, flags)
+        keep = flags[value_cols[0]] == 0
+        df = df[keep].copy()
+        df.loc[flags[value_cols[1]][keep] != 0, value_cols[1]] = np.nan
+        timing.rows_out = len(df)
+    return df
+
 def remove_redundant_col(df,val_col):
     '''
     Removes the column if all of its values are NaN.
@@ -109,33 +249,205 @@ def remove_redundant_col(df,val_col):
     Returns:
       A new dataframe with or without the val_col (dependent on all NaNs or not).
     '''
-    if df[~df[val_col].isnull()].empty:
-        return df.drop(val_col,axis = 1)
-    return df
+    with stage('remove_redundant_col', rows_in=len(df)):
+        if df[~df[val_col].isnull()].empty:
+            return df.drop(val_col,axis = 1)
+        return df
 
 def preprocessing(df,average):
     '''
     Args:
       df: The pandas dataframe with value and timestamp columns.
-      upper_bound: maximum interval an entry can span
-      lower_bound: minimum interval an entry must span
+      average: The type of averaging interval ('daily', 'hourly', etc.).
     Returns an averaged out dataframe with no outliers or NaN values.
     '''
-    result = remove_redundant_col(df,df.columns[3])
-    result = remove_outliers_and_nan(result,result.columns[2],UPPER_TOLERANCE_MOISTURE,LOWER_TOLERANCE_MOISTURE)
-    result = accumulate(result, result.columns[2:],result.columns[1], average)
-    if len(result.columns) == 3:
-        result = remove_redundant_col(result,result.columns[2])
-        if len(result.columns) == 3:
-            valid_values = result[result.columns[2]].notna()
-            some_inside = (result[result.columns[2]][valid_values] < UPPER_TOLERANCE_MOISTURE).any() | (result[result.columns[2]][valid_values] > LOWER_TOLERANCE_MOISTURE).any()
-            if not some_inside: 
-                result = result.drop(result.columns[2],axis=1)
-            else:
-                condition = ~result[result.columns[2]].notna() | ~result[result.columns[2]].between(LOWER_TOLERANCE_MOISTURE, UPPER_TOLERANCE_MOISTURE)
-                result[result.columns[2]] = np.where(condition, np.nan, result[result.columns[2]])
+    return aggregate(df, [average])[average]
+
+def kahan_means(keys, values):
+    '''
+    Averages values per key with the compensated (Kahan) summation used by pandas' groupby().mean(),
+    adding the values of each key in row order, so the means are bit-for-bit those of pandas.
+    The loop runs once per position within a key, vectorized over all keys.
+    Args:
+      keys: 1-D int64 array with the interval key of every row.
+      values: 2-D float array, one column per value column; NaN entries are skipped.
+    Returns:
+      A tuple (keys, means) with one sorted entry per unique key.
+    '''
+    if np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+    # keys are sorted, so every key is a contiguous run of rows
+    group = np.cumsum(np.diff(keys, prepend=keys[:1]) != 0)
+    unique_keys = keys[np.flatnonzero(np.diff(group, prepend=-1))]
+    means = np.full((len(unique_keys), values.shape[1]), np.nan)
+    for j in range(values.shape[1]):
+        valid = ~np.isnan(values[:, j])
+        col_group, col_values = group[valid], values[valid, j]
+        starts = np.flatnonzero(np.diff(col_group, prepend=-1))
+        sizes = np.diff(np.append(starts, len(col_group)))
+        total, compensation = np.zeros(len(starts)), np.zeros(len(starts))
+        for k in range(sizes.max(initial=0)):
+            active = np.flatnonzero(sizes > k)
+            y = col_values[starts[active] + k] - compensation[active]
+            t = total[active] + y
+            compensation[active] = t - total[active] - y
+            total[active] = t
+        means[col_group[starts], j] = total / sizes
+    return unique_keys, means
+
+def kahan_sums(keys, values, state=None):
+    '''
+    Continues per-key compensated (Kahan) sums with more rows, in the order of kahan_means(): the
+    values of each key are added in row order, after the ones already summed into `state`.
+    Summing the rows of a key in one call or over several calls in row order gives the same bits.
+    Args:
+      keys: 1-D int64 array with the interval key of every row.
+      values: 2-D float array, one column per value column; NaN entries are skipped.
+      state: A tuple (keys, totals, compensations, counts) from an earlier call, or None.
+    Returns:
+      A tuple (keys, totals, compensations, counts) with one sorted entry per key seen so far;
+      totals / counts are the means of kahan_means().
+    '''
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    columns = values.shape[1]
+    if state is None:
+        state = (np.empty(0, dtype='int64'), np.zeros((0, columns)), np.zeros((0, columns)), np.zeros((0, columns), dtype='int64'))
+    all_keys = np.union1d(state[0], keys)
+    totals, compensations = np.zeros((len(all_keys), columns)), np.zeros((len(all_keys), columns))
+    counts = np.zeros((len(all_keys), columns), dtype='int64')
+    previous = np.searchsorted(all_keys, state[0])
+    totals[previous], compensations[previous], counts[previous] = state[1], state[2], state[3]
+    group = np.searchsorted(all_keys, keys)
+    for j in range(columns):
+        valid = ~np.isnan(values[:, j])
+        col_group, col_values = group[valid], values[valid, j]
+        starts = np.flatnonzero(np.diff(col_group, prepend=-1))
+        sizes = np.diff(np.append(starts, len(col_group)))
+        total, compensation = totals[col_group[starts], j], compensations[col_group[starts], j]
+        for k in range(sizes.max(initial=0)):
+            active = np.flatnonzero(sizes > k)
+            y = col_values[starts[active] + k] - compensation[active]
+            t = total[active] + y
+            compensation[active] = t - total[active] - y
+            total[active] = t
+        totals[col_group[starts], j], compensations[col_group[starts], j] = total, compensation
+        counts[col_group[starts], j] += sizes
+    return all_keys, totals, compensations, counts
+
+def finish_average(avg_df, columns, average):
+    '''
+    Completes and rounds an averaged dataframe.
+    Args:
+      avg_df: A pandas dataframe with a TimeStamp column and the mean of every value column.
+      columns: The value columns to keep in the output.
+      average: The type of averaging interval ('daily', 'hourly', etc.).
+    Returns:
+      The averaged dataframe as it is written to file.
+    '''
+    avg_df = complete_intervals(avg_df[['TimeStamp'] + columns], average)
+    # Round the averages to 3 decimal places
+    for col in columns:
+        avg_df[col] = avg_df[col].round(3)
+    return avg_df
+
+def aggregate(df, averages=None, on_flags=None):
+    '''
+    Cleans a station dataframe once and averages it at every requested resolution.
+    Timestamps are converted to integer epoch nanoseconds once, and every resolution is
+    grouped by flooring that array to its interval width.
+    Args:
+      df: The pandas dataframe with TimeStamp and value columns, sorted by TimeStamp.
+      averages: The averaging intervals to compute; all registered ones by default.
+      on_flags: Passed to quality_control(), to receive the QC flags of the readings.
+    Returns:
+      A dictionary mapping each averaging interval to its averaged dataframe.
+    '''
+    value_cols = DATA_COLUMNS[1:]
+    # the second sensor column is only kept if it has a value anywhere in the file
+    columns = value_cols if df[value_cols[1]].notna().any() else value_cols[:1]
+    cleaned = quality_control(df, on_flags)
+    epoch = cleaned['TimeStamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    values = cleaned[value_cols].to_numpy(dtype='float64')
+    results = {}
+    for average in averages or RESOLUTIONS:
+        resolution = get_resolution(average)
+        with stage('accumulate', average, rows_in=len(values)) as timing:
+            keys, means = kahan_means(epoch - epoch % resolution.freq.value + resolution.offset.value, values)
+            avg_df = pd.DataFrame(means, columns=value_cols)
+            avg_df.insert(0, 'TimeStamp', keys.view('datetime64[ns]'))
+            timing.rows_out = len(avg_df)
+        results[average] = finish_average(avg_df, columns, average)
+    return results
+
+def preprocessing_chunked(chunks, averages=None, on_flags=None):
+    '''
+    Averages a station file that is read in chunks, keeping memory bounded by the number of
+    intervals rather than the number of rows. The compensated sums of every interval are carried
+    across chunks with kahan_sums(), and the rows of the interval at the end of a chunk are held
+    back and averaged with the next chunk, so the rows of an interval are summed together in
+    timestamp order, as by aggregate(). For a file in ascending or descending time order the
+    averages are identical to aggregate()'s; only when the rows of one interval are scattered
+    over several chunks are they summed in file order, and a mean landing exactly on a rounding
+    tie can then differ in the last decimal. Neighbour QC checks (spikes, rate of change, flat
+    lines) are evaluated within each chunk, so they do not see across chunk boundaries.
+    Args:
+      chunks: An iterable of dataframes with TimeStamp and value columns, as yielded by iter_station_chunks.
+      averages: The averaging intervals to compute; all registered ones by default.
+      on_flags: Passed to quality_control(), to receive the QC flags of every chunk's readings.
+    Returns:
+      A dictionary mapping each averaging interval to its averaged dataframe.
+    '''
+    value_cols = DATA_COLUMNS[1:]
+    averages = list(averages or RESOLUTIONS)
+    sums = dict.fromkeys(averages)
+    # held-back rows share the coarsest interval, which every other interval divides
+    width = append_width()
+    held = None
+    has_second = False
+
+    def add(rows):
+        rows = rows.sort_values(by='TimeStamp', kind='stable')
+        epoch = rows['TimeStamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+        values = rows[value_cols].to_numpy(dtype='float64')
+        for average in averages:
+            resolution = get_resolution(average)
+            with stage('accumulate', average, rows_in=len(values)) as timing:
+                intervals = 0 if sums[average] is None else len(sums[average][0])
+                sums[average] = kahan_sums(epoch - epoch % resolution.freq.value + resolution.offset.value, values, sums[average])
+                timing.rows_out = len(sums[average][0]) - intervals  # new intervals
 
-    return result
+    for chunk in chunks:
+        if not len(chunk):
+            # e.g. a chunk of blank filler rows; the held-back rows wait for the next chunk with data
+            continue
+        # the second sensor column is only kept if it has a value anywhere in the file
+        has_second = has_second or chunk[value_cols[1]].notna().any()
+        # the interval of the chunk's last row in file order is the one the next chunk may continue
+        boundary = chunk['TimeStamp'].iloc[-1].value
+        cleaned = quality_control(chunk, on_flags)
+        if held is not None:
+            cleaned, held = pd.concat([held, cleaned], ignore_index=True), None
+        if width is not None:
+            epoch = cleaned['TimeStamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+            last = epoch - epoch % width == boundary - boundary % width
+            held, cleaned = cleaned[last], cleaned[~last]
+        add(cleaned)
+    if held is not None:
+        add(held)
+    columns = value_cols if has_second else value_cols[:1]
+    results = {}
+    for average in averages:
+        if sums[average] is None:
+            sums[average] = kahan_sums(np.empty(0, dtype='int64'), np.empty((0, len(value_cols))))
+        keys, totals, _, counts = sums[average]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+        avg_df = pd.DataFrame(means, columns=value_cols)
+        avg_df.insert(0, 'TimeStamp', keys.view('datetime64[ns]'))
+        results[average] = finish_average(avg_df, columns, average)
+    return results
 
 def try_convert_and_format(value):
   """
@@ -147,6 +459,122 @@ def try_convert_and_format(value):
   except ValueError:
     return value
 
+def station_title(metadata_df,year):
+    '''
+    Returns the 'witsms_gpi=..._lat=..._lon=...' name shared by the output files of a station.
+    Args:
+     metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
+     year: the particular year pertaining to the data.
+    '''
+    num = try_convert_and_format(metadata_df["Sr No."])
+    return "witsms_gpi="+str(int(year))+num+"_lat="+str(metadata_df["Latitude"])+"_lon="+str(metadata_df["Longitude"])
+
+def output_file(title,average,file_format='csv'):
+    '''
+    Returns the path of an output file relative to OUTDIR.
+    '''
+    resolution = get_resolution(average)
+    return os.path.join(resolution.folder, title + resolution.suffix + FILE_EXTENSIONS[file_format])
+
+def write_output(result,out_file,file_format):
+    '''
+    Saves one averaged dataframe in the given file format.
+    Parquet and Feather files keep the TimeStamp column as datetimes and the values as float64,
+    and need the optional pyarrow package.
+    '''
+    if file_format == 'csv':
+        result.to_csv(out_file, index=False, header=True)
+    elif file_format == 'parquet':
+        result.to_parquet(out_file, index=False)
+    elif file_format == 'feather':
+        result.reset_index(drop=True).to_feather(out_file)
+    else:
+        raise ValueError(f"Unknown output file format: {file_format}")
+
+def read_output(out_file):
+    '''
+    Reads an output file written by write_output, in any of the supported formats.
+    '''
+    if out_file.endswith(FILE_EXTENSIONS['parquet']):
+        return pd.read_parquet(out_file)
+    if out_file.endswith(FILE_EXTENSIONS['feather']):
+        return pd.read_feather(out_file)
+    return pd.read_csv(out_file, parse_dates=['TimeStamp'])
+
+def write_outputs(results,metadata_df,year):
+    '''
+    Saves the averaged dataframes of one station in their resolution folders, once per format
+    in OUTPUT_FILE_FORMATS. Empty results are not written, so no header-only files are left to remove.
+    Args:
+     results: A dictionary mapping averaging intervals in RESOLUTIONS to their averaged dataframes.
+     metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
+     year: the particular year pertaining to the data.
+    Returns:
+     list: The paths, relative to OUTDIR, of the files written with at least one row of data.
+    '''
+    title = station_title(metadata_df, year)
+    path = OUTDIR+"/"
+
+    outputs = []
+    for average, result in results.items():
+        if result.empty:
+            continue
+        for file_format in OUTPUT_FILE_FORMATS:
+            out_file = os.path.join(path, output_file(title, average, file_format))
+            # Ensure the necessary directories exist
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            with stage('write', average, rows_in=len(result)) as timing:
+                write_output(result, out_file, file_format)
+                if enabled():
+                    timing.bytes = os.path.getsize(out_file)
+            outputs.append(output_file(title, average, file_format))
+    return outputs
+
+def qc_flag_frame(df, flags=None):
+    '''
+    Returns the readings of a station dataframe with the QC flag of each sensor column next to it,
+    in time order. Flags already evaluated by quality_control() are passed in with the dataframe
+    in the same order; otherwise they are evaluated here.
+    '''
+    if flags is None:
+        if not df['TimeStamp'].is_monotonic_increasing:
+            df = df.sort_values(by='TimeStamp', kind='stable')
+        flags = station_qc_flags(df)
+    frame = df[['TimeStamp']].reset_index(drop=True)
+    for col in DATA_COLUMNS[1:]:
+        frame[col] = df[col].to_numpy()
+        frame[col + QC_FLAG_SUFFIX] = flags[col]
+    return frame
+
+def write_qc_flags(flag_frame,metadata_df,year,file_formats=None,append=False):
+    '''
+    Saves the QC flags of a station's readings in the QC_FOLDER, once per format in OUTPUT_FILE_FORMATS.
+    Args:
+     flag_frame: The readings and flags, as returned by qc_flag_frame.
+     metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
+     year: the particular year pertaining to the data.
+     file_formats: The formats to save in, OUTPUT_FILE_FORMATS by default.
+     append: Add the rows to the end of the .csv files written before, e.g. for the next chunk of
+             a file; only the 'csv' format can be appended to.
+    Returns:
+     list: The paths, relative to OUTDIR, of the files written.
+    '''
+    if flag_frame.empty:
+        return []
+    outputs = []
+    for file_format in file_formats or OUTPUT_FILE_FORMATS:
+        out = os.path.join(QC_FOLDER, station_title(metadata_df, year) + "_QC" + FILE_EXTENSIONS[file_format])
+        os.makedirs(os.path.join(OUTDIR, QC_FOLDER), exist_ok=True)
+        with stage('write', 'qc', rows_in=len(flag_frame)) as timing:
+            if append:
+                flag_frame.to_csv(os.path.join(OUTDIR, out), mode='a', index=False, header=False)
+            else:
+                write_output(flag_frame, os.path.join(OUTDIR, out), file_format)
+            if enabled():
+                timing.bytes = os.path.getsize(os.path.join(OUTDIR, out))
+        outputs.append(out)
+    return outputs
+
 def process_three_formats(df,metadata_df,year):
     '''
     Generates and saves three .csv files containing hourly, trihourly and daily averaged data.
@@ -154,38 +582,158 @@ def process_three_formats(df,metadata_df,year):
      df: The pandas dataframe with value and timestamp columns.s
      metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
      year: the particular year pertaining to the data.
+    Returns:
+     list: The paths, relative to OUTDIR, of the files written with at least one row of data.
     '''
-    result_daily = preprocessing(df, average='daily')
-    result_hourly = preprocessing(df, average='hourly')
-    result_tri_hourly = preprocessing(df, average='3hourly')
-    result_thirty_mins = preprocessing(df, average='30minute')
-    
-    num = try_convert_and_format(metadata_df["Sr No."])
-    title = "witsms_gpi="+str(int(year))+num+"_lat="+str(metadata_df["Latitude"])+"_lon="+str(metadata_df["Longitude"])
-    path = OUTDIR+"/"
+    return write_outputs(aggregate(df), metadata_df, year)
 
-    # Ensure the necessary directories exist
-    daily_path = os.path.join(path, "daily")
-    hourly_path = os.path.join(path, "hourly")
-    tri_hourly_path = os.path.join(path, "tri_hourly")
-    thirty_min_path = os.path.join(path, "30_min")
-    
-    os.makedirs(daily_path, exist_ok=True)
-    os.makedirs(hourly_path, exist_ok=True)
-    os.makedirs(tri_hourly_path, exist_ok=True)
-    os.makedirs(thirty_min_path, exist_ok=True)
-    
-    # Save the CSV files to the appropriate directories
-    result_daily.to_csv(os.path.join(daily_path, title + "_24H.csv"), index=False, header=True)
-    result_hourly.to_csv(os.path.join(hourly_path, title + "_1H.csv"), index=False, header=True)
-    result_tri_hourly.to_csv(os.path.join(tri_hourly_path, title + "_3H.csv"), index=False, header=True)
-    result_thirty_mins.to_csv(os.path.join(thirty_min_path, title + "_30m.csv"), index=False, header=True)
-    
+def parse_timestamps(timestamps, formats=TIMESTAMP_FORMATS):
+  """
+    Converts a column of timestamp strings to datetimes without a per-row fallback.
+    Each format is tried in turn on the entries that are still unparsed, so a file that mixes
+    the 12-hour and the 24-hour logger formats is parsed in one vectorized call per format.
 
+    Args:
+        timestamps (Series): The raw TimeStamp column.
+        formats (list): The formats to try, in order.
+
+    Returns:
+        tuple: The parsed Series (NaT where no format matched) and the list of formats
+               that matched at least one entry, most frequent first.
+  """
+  parsed = pd.Series(pd.NaT, index=timestamps.index, dtype='datetime64[ns]')
+  matched = {}
+  for fmt in formats:
+      missing = parsed.isna() & timestamps.notna()
+      if not missing.any():
+          break
+      converted = pd.to_datetime(timestamps[missing], format=fmt, errors='coerce')
+      if converted.notna().any():
+          matched[fmt] = int(converted.notna().sum())
+          parsed[missing] = converted
+  detected = sorted(matched, key=matched.get, reverse=True)
+  return parsed, detected
+
+def clean_timestamps(df, file_path, formats=None):
+  """
+    Parses the TimeStamp column of a raw dataframe and drops the rows it could not parse,
+    reporting how many there were and where they are in the file.
+    The formats that matched are stored in df.attrs['timestamp_formats'].
+
+    Args:
+        df (DataFrame): A raw dataframe with a TimeStamp column of strings.
+        file_path (str): The path to the raw CSV file, for reporting.
+        formats (list): The formats to try first, e.g. the ones cached for this station.
+
+    Returns:
+        DataFrame: The dataframe with a datetime TimeStamp column.
+  """
+  formats = list(formats or []) + [fmt for fmt in TIMESTAMP_FORMATS if fmt not in (formats or [])]
+  with stage('parse_timestamps', rows_in=len(df)) as timing:
+      parsed, detected = parse_timestamps(df["TimeStamp"], formats)
+      unparsed = parsed.isna() & df["TimeStamp"].notna()
+      if unparsed.any():
+          # 4 preamble lines and the header precede the data
+          lines = (df.index[unparsed] + 6).tolist()
+          print(f"Unparseable timestamps in {file_path}: {len(lines)} rows, at lines {lines[:10]}{' ...' if len(lines) > 10 else ''}")
+      df["TimeStamp"] = parsed
+      df = df[parsed.notna()]
+      timing.rows_out = len(df)
+  df.attrs['timestamp_formats'] = detected
+  return df
+
+def read_station_file(file_path, formats=None):
+  """
+    Reads a raw station CSV file into a DataFrame sorted by timestamp.
+
+    Args:
+        file_path (str): The path to the raw CSV file.
+        formats (list): The timestamp formats to try first.
+
+    Returns:
+        DataFrame: The index, TimeStamp and volumetric water content columns of the file.
+  """
+  with stage('read') as timing:
+      df = pd.read_csv(file_path, skiprows=4, usecols=DATA_COLUMNS)[DATA_COLUMNS]
+      timing.rows_out = len(df)
+  df = clean_timestamps(df, file_path, formats)
+  df = df.sort_values(by='TimeStamp', kind='stable')
+  return df.reset_index()
+
+def iter_station_chunks(file_path, chunksize, formats=None):
+  """
+    Reads a raw station CSV file in chunks of at most `chunksize` rows.
+
+    Args:
+        file_path (str): The path to the raw CSV file.
+        chunksize (int): The number of rows per chunk.
+        formats (list): The timestamp formats to try first.
+
+    Yields:
+        DataFrame: The TimeStamp and volumetric water content columns of each chunk, in file order.
+  """
+  with pd.read_csv(file_path, skiprows=4, usecols=DATA_COLUMNS, chunksize=chunksize) as reader:
+      reader = iter(reader)
+      while True:
+          with stage('read') as timing:
+              chunk = next(reader, None)
+              timing.rows_out = 0 if chunk is None else len(chunk)
+          if chunk is None:
+              return
+          yield clean_timestamps(chunk[DATA_COLUMNS].copy(), file_path, formats)
+
+def station_key(file_path):
+  """
+    Returns the '<year>/<file name>' key identifying a raw station file across runs.
+  """
+  return os.path.basename(os.path.dirname(file_path)) + "/" + os.path.basename(file_path)
+
+def load_timestamp_formats(directory):
+  """
+    Loads the timestamp formats detected per station in earlier runs.
+
+    Args:
+        directory (str): The output directory holding the cache file.
+
+    Returns:
+        dict: Station key -> list of formats, most frequent first.
+  """
+  try:
+    with open(os.path.join(directory, TIMESTAMP_FORMAT_CACHE), 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def save_timestamp_formats(directory, formats):
+  """
+    Saves the timestamp formats detected per station so later runs can skip detection.
+
+    Args:
+        directory (str): The output directory holding the cache file.
+        formats (dict): Station key -> list of formats, most frequent first.
+  """
+  os.makedirs(directory, exist_ok=True)
+  with open(os.path.join(directory, TIMESTAMP_FORMAT_CACHE), 'w', encoding='utf-8') as f:
+    json.dump(formats, f, indent=1, sort_keys=True)
+
+def list_station_files(folder_paths):
+  """
+    Lists the raw CSV files in the specified folder paths.
+
+    Args:
+        folder_paths (list): A list of strings representing folder paths containing CSV files.
+
+    Returns:
+        list: A list of lists, where each inner list contains the naturally sorted
+              file paths from a single folder path.
+  """
+  csv_files = [glob.glob(os.path.join(path, "*.csv")) for path in folder_paths]
+  return [natural_sort(file_paths) for file_paths in csv_files]
 
 def prepare_dataframes(folder_paths):
   """
     Prepares DataFrames from CSV files in specified folder paths.
+    All files are held in memory at once; preprocess() streams them one station at a time instead.
 
     Args:
         folder_paths (list): A list of strings representing folder paths containing CSV files.
@@ -194,33 +742,319 @@ def prepare_dataframes(folder_paths):
         list: A list of lists, where each inner list contains DataFrames
               corresponding to CSV files from a single folder path.
   """
-  csv_files = [glob.glob(path + "\*.csv") for path in folder_paths]
-  
-  csv_files = [natural_sort(file_paths) for file_paths in csv_files]
+  csv_files = list_station_files(folder_paths)
   
   dataframes = [] 
   for i in range(len(csv_files)):
       print("DATAFRAMES PROCESSING...(",i+1,"/",len(csv_files),")")
-      dfs=[pd.read_csv(file_path, skiprows=4) for file_path in csv_files[i]]
-      dfs = [df[["TimeStamp","VolumetricWaterContent1","VolumetricWaterContent2"]] for df in dfs]
-      for df in dfs:
-          try:
-              df["TimeStamp"] = pd.to_datetime(df["TimeStamp"],format='%m/%d/%Y %I:%M:%S %p')
-          except:
-              try:
-                  df["TimeStamp"] = pd.to_datetime(df["TimeStamp"],format='%m/%d/%Y %H:%M')
-              except:
-                  for j,row in df.iterrows(): 
-                      try:
-                          df.loc[j,"TimeStamp"] = pd.to_datetime(df.loc[j,"TimeStamp"],format='%m/%d/%Y %H:%M')
-                      except:
-                          df.loc[j,"TimeStamp"] = pd.to_datetime(df.loc[j,"TimeStamp"],format='%m/%d/%Y %I:%M:%S %p')
-      dfs = [df.sort_values(by='TimeStamp') for df in dfs]
-      dfs = [df.reset_index() for df in dfs]
-      dataframes.append(dfs)    
+      dataframes.append([read_station_file(file_path) for file_path in csv_files[i]])
   
   return dataframes
 
+def process_station(file_path, metadata_df, year, chunksize=None, formats=None, append=False):
+    """
+    Reads, cleans, averages and saves a single raw station file.
+    The station's data is released once its outputs are written.
+
+    Args:
+        file_path (str): The path to the raw CSV file.
+        metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
+        year: the particular year pertaining to the data.
+        chunksize (int): If given, the file is read in chunks of this many rows so that memory stays
+                         bounded for very long files.
+        formats (list): The timestamp formats to try first, e.g. the ones detected in an earlier run.
+        append (bool): Locate the tail of the file with find_tail(), for later appends to be merged.
+
+    Returns:
+        dict: The timestamp formats detected in the file, most frequent first, the output files
+              written and the tail of the file as located by find_tail() (None unless append is set).
+    """
+    flag_outputs = []
+    if chunksize:
+        detected = []
+        tail = TailTracker()
+        def chunks():
+            for chunk in iter_station_chunks(file_path, chunksize, formats):
+                detected.extend(fmt for fmt in chunk.attrs['timestamp_formats'] if fmt not in detected)
+                tail.update(chunk['TimeStamp'])
+                yield chunk
+        def save_flags(rows, flags):
+            # the flags of every chunk are appended to one .csv file, so they are never all held in memory
+            written = write_qc_flags(qc_flag_frame(rows, flags), metadata_df, year, ['csv'], append=bool(flag_outputs))
+            flag_outputs[:] = written or flag_outputs
+        outputs = write_outputs(preprocessing_chunked(chunks(), on_flags=save_flags if QC_WRITE_FLAGS else None), metadata_df, year)
+    else:
+        df = read_station_file(file_path, formats)
+        flag_frames = []
+        def save_flags(rows, flags):
+            flag_frames.append(qc_flag_frame(rows, flags))
+        outputs = write_outputs(aggregate(df, on_flags=save_flags if QC_WRITE_FLAGS else None), metadata_df, year)
+        if flag_frames:
+            flag_outputs = write_qc_flags(flag_frames[0], metadata_df, year)
+        detected = df.attrs['timestamp_formats']
+        tail = TailTracker()
+        tail.update(df['TimeStamp'])
+    return {
+        'timestamp_formats': detected,
+        'outputs': outputs + flag_outputs,
+        'tail': find_tail(file_path, tail.cutoff, tail.rows, detected) if append else None,
+    }
+
+class TailTracker:
+    """
+    Tracks the last append interval of a station's timestamps and how many rows fall in it,
+    over one or more chunks.
+    """
+    def __init__(self):
+        self.cutoff = None
+        self.rows = 0
+
+    def update(self, timestamps):
+        width = append_width()
+        if width is None or timestamps.empty:
+            return
+        epoch = timestamps.to_numpy(dtype='datetime64[ns]').view('int64')
+        keys = epoch - epoch % width
+        last = int(keys.max())
+        if self.cutoff is None or last > self.cutoff:
+            self.cutoff, self.rows = last, 0
+        if last == self.cutoff:
+            self.rows += int((keys == last).sum())
+
+def append_width():
+    """
+    Returns the width in nanoseconds of the coarsest registered resolution, the unit in which
+    appended data is re-aggregated, or None if the other widths do not all divide it.
+    """
+    widths = [resolution.freq.value for resolution in RESOLUTIONS.values()]
+    coarsest = max(widths)
+    if any(coarsest % width for width in widths):
+        return None
+    return coarsest
+
+def find_tail(file_path, cutoff, rows, formats=None):
+    """
+    Locates the byte offset where the last append interval of a station file begins, so that
+    rows appended later can be re-aggregated together with that interval only.
+    The file is read backwards in growing blocks until a row before the cutoff is found.
+
+    Args:
+        file_path (str): The path to the raw CSV file.
+        cutoff (int): The start of the last append interval, in epoch nanoseconds.
+        rows (int): The number of rows of the whole file in that interval.
+        formats (list): The timestamp formats to try first.
+
+    Returns:
+        dict: The offset, cutoff and the raw header columns, or None if the rows of the last
+              interval are not all at the end of the file (e.g. a file in descending order).
+    """
+    if cutoff is None:
+        return None
+    header = list(pd.read_csv(file_path, skiprows=4, nrows=0).columns)
+    column = header.index("TimeStamp")
+    size = os.path.getsize(file_path)
+    block = 1 << 16
+    while True:
+        start = max(0, size - block)
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        lines = data.split(b"\n")
+        offsets = np.cumsum([start] + [len(line) + 1 for line in lines[:-1]])
+        # the first line of a block is partial; at the start of the file skip the preamble and header
+        first = 5 if start == 0 else 1
+        lines, offsets = lines[first:], offsets[first:]
+        values = [next(csv.reader([line.decode('utf-8', 'replace')]), [""]) for line in lines]
+        timestamps = pd.Series([value[column] if len(value) > column else None for value in values])
+        parsed, _ = parse_timestamps(timestamps, list(formats or []) + [fmt for fmt in TIMESTAMP_FORMATS if fmt not in (formats or [])])
+        epoch = parsed.to_numpy(dtype='datetime64[ns]').view('int64')
+        before = np.flatnonzero(parsed.notna().to_numpy() & (epoch < cutoff))
+        if len(before) or start == 0:
+            boundary = before[-1] + 1 if len(before) else 0
+            in_tail = parsed.notna().to_numpy()[boundary:]
+            if int(in_tail.sum()) != rows or boundary >= len(offsets):
+                return None
+            return {'offset': int(offsets[boundary]), 'cutoff': int(cutoff), 'header': header}
+        block *= 4
+
+def append_station(file_path, metadata_df, year, tail, formats=None):
+    """
+    Re-aggregates only the end of a raw station file that has grown by appended rows.
+    The rows from the start of the last append interval of the previous run to the end of the
+    file are read and averaged, and replace the output rows from that interval on.
+
+    Args:
+        file_path (str): The path to the raw CSV file.
+        metadata_df: The slice of pandas dataframe containing supplementary information for file naming.
+        year: the particular year pertaining to the data.
+        tail (dict): The tail of the previous run, as returned by find_tail().
+        formats (list): The timestamp formats to try first.
+
+    Returns:
+        dict: Like process_station(), or None if the appended rows cannot be merged
+              (rows dated before the tail, or a different set of output columns), in which
+              case nothing is written and the file should be processed in full. Stations with
+              neighbour QC checks or QC flag files are always processed in full, as those
+              look at the readings before the tail too.
+    """
+    if QC_WRITE_FLAGS or neighbour_checks_enabled():
+        return None
+    with open(file_path, 'rb') as f:
+        f.seek(tail['offset'])
+        data = f.read()
+    with stage('read') as timing:
+        df = pd.read_csv(io.BytesIO(data), header=None, names=tail['header'], usecols=DATA_COLUMNS)[DATA_COLUMNS]
+        timing.rows_out = len(df)
+    df = clean_timestamps(df, file_path, formats)
+    cutoff = pd.Timestamp(tail['cutoff'])
+    if df.empty or (df['TimeStamp'] < cutoff).any():
+        return None
+    results = aggregate(df.sort_values(by='TimeStamp').reset_index())
+
+    title = station_title(metadata_df, year)
+    merged = {}
+    for average, result in results.items():
+        out_file = os.path.join(OUTDIR, output_file(title, average, OUTPUT_FILE_FORMATS[0]))
+        if not os.path.exists(out_file):
+            return None
+        previous = read_output(out_file)
+        if list(previous.columns) != list(result.columns):
+            return None
+        previous = previous[previous['TimeStamp'] < cutoff]
+        merged[average] = complete_intervals(pd.concat([previous, result], ignore_index=True), average)
+    outputs = write_outputs(merged, metadata_df, year)
+
+    tracker = TailTracker()
+    tracker.update(df['TimeStamp'])
+    return {
+        'timestamp_formats': df.attrs['timestamp_formats'],
+        'outputs': outputs,
+        'tail': find_tail(file_path, tracker.cutoff, tracker.rows, formats),
+    }
+
+def file_digest(file_path, prefix_size=None):
+    """
+    Computes the SHA-256 digest of a file, and optionally of its first `prefix_size` bytes, in one read.
+
+    Args:
+        file_path (str): The path to the file.
+        prefix_size (int): The length of the prefix to digest as well.
+
+    Returns:
+        tuple: The hex digest of the file and of the prefix (None if not requested or longer than the file).
+    """
+    digest = hashlib.sha256()
+    prefix_digest = None
+    position = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            if prefix_size is not None and position <= prefix_size < position + len(block):
+                digest.update(block[:prefix_size - position])
+                prefix_digest = digest.hexdigest()
+                block = block[prefix_size - position:]
+                position = prefix_size
+            digest.update(block)
+            position += len(block)
+    return digest.hexdigest(), prefix_digest
+
+def load_manifest(directory):
+    """
+    Loads the manifest of the raw files processed into a directory.
+
+    Args:
+        directory (str): The output directory holding the manifest.
+
+    Returns:
+        dict: Station key -> manifest entry, as built by update_station().
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(directory, manifest):
+    """
+    Saves the manifest of the raw files processed into a directory.
+
+    Args:
+        directory (str): The output directory holding the manifest.
+        manifest (dict): Station key -> manifest entry.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # written aside and swapped in, so that a run interrupted while saving keeps the previous manifest
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def processing_settings(metadata_df, year):
+    """
+    Returns the settings a station's outputs depend on besides the raw file itself.
+    A station whose manifest entry was made with other settings is processed in full.
+    """
+    return {
+        'tolerances': [LOWER_TOLERANCE_MOISTURE, UPPER_TOLERANCE_MOISTURE],
+        'title': station_title(metadata_df, year),
+        'resolutions': list(RESOLUTIONS),
+        'file_formats': list(OUTPUT_FILE_FORMATS),
+        # the second sensor's range check moved from its averages to its readings; outputs
+        # written before that are processed again
+        'qc': dict(qc_settings(), write_flags=QC_WRITE_FLAGS, second_sensor='readings'),
+    }
+
+def is_current(entry, file_path, settings):
+    """
+    Checks from the manifest alone, without reading the file, that a station's outputs are up to date:
+    same size, mtime and settings, and every recorded output still in place.
+    """
+    if not entry or any(entry.get(name) != value for name, value in settings.items()):
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        # e.g. removed since the folder was listed; processing it reports the error
+        return False
+    if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+        return False
+    return all(os.path.exists(os.path.join(OUTDIR, out)) for out in entry['outputs'])
+
+def update_station(job):
+    """
+    Brings the outputs of one station up to date and builds its new manifest entry.
+    A file whose content hash is unchanged and whose outputs are all in place is not processed
+    again. In append mode, a file whose
+    previous content is an unchanged prefix only has its tail re-aggregated.
+
+    Args:
+        job (StationJob): The station to process.
+
+    Returns:
+        dict: The manifest entry, with a 'status' of 'unchanged', 'appended' or 'processed'.
+    """
+    settings = processing_settings(job.metadata, job.year)
+    stat = os.stat(job.file_path)
+    previous = job.previous
+    if previous and any(previous.get(name) != value for name, value in settings.items()):
+        previous = None
+    grown = bool(previous and job.append and previous.get('tail') and stat.st_size > previous['size'])
+    with stage('digest'):
+        digest, prefix_digest = file_digest(job.file_path, previous['size'] if grown else None)
+
+    info = None
+    outputs_present = bool(previous) and all(os.path.exists(os.path.join(OUTDIR, out)) for out in previous['outputs'])
+    if outputs_present and digest == previous['sha256']:
+        info = dict(previous, status='unchanged', timestamp_formats=job.formats or [])
+    elif grown and prefix_digest == previous['sha256']:
+        info = append_station(job.file_path, job.metadata, job.year, previous['tail'], job.formats)
+        if info:
+            info['status'] = 'appended'
+    if info is None:
+        info = process_station(job.file_path, job.metadata, job.year, job.chunksize, job.formats, job.append)
+        info['status'] = 'processed'
+    info.update(settings, size=stat.st_size, mtime=stat.st_mtime, sha256=digest)
+    return info
+
 def prepare_metadata(metadata_filepath,sheet_names):
     """
     Prepares a list of DataFrames from an Excel file containing metadata.
@@ -234,50 +1068,314 @@ def prepare_metadata(metadata_filepath,sheet_names):
         list: A list of DataFrames, where each DataFrame corresponds to a sheet
               in the Excel file specified by `sheet_names`.
     """
-    metadata = [pd.read_excel(metadata_filepath,sheet_name=str(sheet)) for sheet in sheet_names]
+    sheets = pd.read_excel(metadata_filepath,sheet_name=[str(sheet) for sheet in sheet_names])
+    metadata = [sheets[str(sheet)] for sheet in sheet_names]
     
     return metadata
 
+def load_metadata(metadata_filepath, sheet_names, directory):
+    """
+    Returns the metadata sheets like prepare_metadata(), parsing the workbook only if it changed
+    since it was last parsed. The parsed sheets are kept in a sidecar file in `directory`, keyed
+    by the workbook's path, size and mtime and the sheets read.
+
+    Args:
+        metadata_filepath (str): The path to the Excel file containing metadata.
+        sheet_names (list): The names of the sheets to read.
+        directory (str): The output directory holding the sidecar file.
+
+    Returns:
+        list: A list of DataFrames, one per sheet in `sheet_names`.
+    """
+    stat = os.stat(metadata_filepath)
+    key = {'source': os.path.abspath(metadata_filepath), 'size': stat.st_size, 'mtime': stat.st_mtime,
+           'sheets': [str(sheet) for sheet in sheet_names]}
+    cache_path = os.path.join(directory, METADATA_CACHE)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return cached['metadata']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, AttributeError):
+        pass
+    metadata = prepare_metadata(metadata_filepath, sheet_names)
+    os.makedirs(directory, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        pickle.dump({'key': key, 'metadata': metadata}, f)
+    return metadata
+
+def serial_key(value):
+    """
+    Normalizes a station serial number, from a file name or the 'Sr No.' column, for matching:
+    '013', 13 and 13.0 all give '13'.
+    """
+    value = str(value).strip()
+    try:
+        return str(int(float(value)))
+    except ValueError:
+        return value
 
-def preprocess(metadata_file_path, metadata_file_sheets, data_file_paths):
+def station_serial(file_path):
+    """
+    Returns the serial number leading a raw file name, e.g. '110' for '110_ test_farms _ wheat.csv'.
+    """
+    return serial_key(os.path.basename(file_path).split("_")[0])
+
+def match_station_files(metadata, metadata_file_sheets, station_files):
+    """
+    Joins raw station files to their metadata rows by serial number instead of by position,
+    through a hash index of each sheet's 'Sr No.' column.
+
+    Args:
+        metadata (list): The metadata DataFrames, one per year.
+        metadata_file_sheets (list): The years of the sheets.
+        station_files (list): The raw file paths of every year, as returned by list_station_files.
+
+    Returns:
+        tuple: The matched stations as (file_path, metadata row, year) tuples, the files without
+               a metadata row, and the metadata rows without a file as (year, 'Sr No.') tuples.
+    """
+    matched, unmatched_files, unmatched_rows = [], [], []
+    for sheet, year, file_list in zip(metadata, metadata_file_sheets, station_files):
+        index = {}
+        for position, serial in enumerate(sheet["Sr No."]):
+            if pd.notna(serial):
+                index.setdefault(serial_key(serial), position)
+        used = set()
+        for file_path in file_list:
+            position = index.get(station_serial(file_path))
+            if position is None or position in used:
+                unmatched_files.append(file_path)
+                continue
+            used.add(position)
+            matched.append((file_path, sheet.iloc[position], year))
+        unmatched_rows.extend((year, sheet["Sr No."].iloc[position]) for position in range(len(sheet)) if position not in used)
+    return matched, unmatched_files, unmatched_rows
+
+
+def run_station_job(job):
+    """
+    Processes one station job, catching any error so that one bad file does not stop the batch.
+    Runs in a worker process when preprocess() is given several workers.
+
+    Args:
+        job (StationJob): The station to process.
+
+    Returns:
+        tuple: The new manifest entry (None on failure) and the error message (None on success).
+               For an instrumented job the entry holds the station's stage records under 'stages'.
+    """
+    try:
+        if job.instrument:
+            with recording(station_key(job.file_path)) as recorder:
+                info = update_station(job)
+            info['stages'] = recorder.records
+            return info, None
+        return update_station(job), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def preprocess(metadata_file_path, metadata_file_sheets, data_file_paths, chunksize=None, workers=None, full=False, append=False, report=None, only=None, changed=None):
     """
     Preprocesses and prepares data from multiple CSV and metadata files.
+    Stations are streamed: each file is read, processed and written before the next one is read.
+    With several workers the stations are processed in parallel by a process pool; progress is
+    still reported in station order, and a station that fails is reported without stopping the others.
+    A manifest in OUTDIR records every raw file processed, so that stations whose file and settings
+    are unchanged since the last run are skipped.
+    Raw files are matched to their metadata row by the serial number leading the file name and the
+    'Sr No.' column; files and rows without a match are reported, and such files are skipped.
 
     Args:
         metadata_file_path (str): The path to the Excel file containing metadata.
         metadata_file_sheets (list): A list of strings representing the names of sheets
                                      to read from the Excel file.
         data_file_paths (list): A list of paths to fetch data from.
+        chunksize (int): If given, each file is read in chunks of this many rows.
+        workers (int): The number of worker processes; stations are processed serially if not above 1.
+        full (bool): Process every station, ignoring the manifest.
+        append (bool): Treat raw files as append-only, re-aggregating only the end of a file that has grown.
+        report (RunReport): If given, the time, rows in and out and bytes written of every stage of
+                            every station are recorded into it.
+        only (list): If given, only the stations of these raw file paths are considered, e.g. the
+                     files that changed since the last run; the other stations and their outputs
+                     are left untouched.
+        changed (set): If given, receives the paths, relative to OUTDIR, of the outputs written or
+                       removed, e.g. to update what is built from them.
     Returns:
-        Nothing. Processes all the dataframes and saves the averaged processed data in three formats in the relevant folders.
+        dict: The stations that failed, mapped to their error messages. Processes all the dataframes and saves the averaged processed data in the relevant folders.
     """
-    metadata = prepare_metadata(metadata_file_path,metadata_file_sheets)
+    metadata = load_metadata(metadata_file_path,metadata_file_sheets,OUTDIR)
     print("METADATA EXTRACTED")
-    dataframes = prepare_dataframes(data_file_paths)
-    print("DATAFRAMES PROCESSED")
-    
-    for i,file_list in enumerate(dataframes):
-        print("YEARS PROCESSED...(",i+1,"/",len(dataframes),")")
-        for j,files in enumerate(file_list):
-            process_three_formats(files,metadata[i].iloc[j],metadata_file_sheets[i])
+    station_files = list_station_files(data_file_paths)
+    stations, unmatched_files, unmatched_rows = match_station_files(metadata, metadata_file_sheets, station_files)
+    if only is not None:
+        only = {os.path.normpath(file_path) for file_path in only}
+        stations = [station for station in stations if os.path.normpath(station[0]) in only]
+        unmatched_files = [file_path for file_path in unmatched_files if os.path.normpath(file_path) in only]
+        unmatched_rows = []
+    if unmatched_files:
+        print(f"FILES WITHOUT METADATA ({len(unmatched_files)}), skipped:")
+        for file_path in unmatched_files:
+            print(f"  {station_key(file_path)}")
+    if unmatched_rows:
+        print(f"METADATA ROWS WITHOUT FILE ({len(unmatched_rows)}):")
+        for year, serial in unmatched_rows:
+            print(f"  {year}: Sr No. {serial}")
+    timestamp_formats = load_timestamp_formats(OUTDIR)
+    manifest = {} if full else load_manifest(OUTDIR)
+
+    jobs = []
+    unchanged = 0
+    for file_path, metadata_df, year in stations:
+        key = station_key(file_path)
+        if is_current(manifest.get(key), file_path, processing_settings(metadata_df, year)):
+            unchanged += 1
+            continue
+        jobs.append(StationJob(file_path,metadata_df,year,chunksize,timestamp_formats.get(key),manifest.get(key),append,report is not None))
+    print("STATIONS UNCHANGED:",unchanged)
+
+    failures = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        results = executor.map(run_station_job, jobs) if executor else map(run_station_job, jobs)
+        for i,(job,(info,error)) in enumerate(zip(jobs,results)):
+            key = station_key(job.file_path)
+            print("STATIONS PROCESSED...(",i+1,"/",len(jobs),")",key,"FAILED" if error else info['status'].upper())
+            if error:
+                failures[key] = error
+                continue
+            if report is not None:
+                report.add(info.pop('stages'))
+            # remove outputs of an earlier run that were not written again, e.g. after a change of coordinates
+            removed = set((job.previous or {}).get('outputs', [])) - set(info['outputs'])
+            for out in removed:
+                if os.path.exists(os.path.join(OUTDIR, out)):
+                    os.remove(os.path.join(OUTDIR, out))
+            if changed is not None and info['status'] != 'unchanged':
+                changed.update(info['outputs'], removed)
+            timestamp_formats[key] = info['timestamp_formats']
+            manifest[key] = {name: value for name, value in info.items() if name not in ('status', 'timestamp_formats')}
+    finally:
+        # saved even when the run is interrupted, e.g. by Ctrl+C or a worker killed for lack of
+        # memory, so that the stations finished so far are not processed again
+        save_timestamp_formats(OUTDIR, timestamp_formats)
+        save_manifest(OUTDIR, manifest)
+        if executor:
+            executor.shutdown()
+
+    if failures:
+        print(f"FAILED STATIONS ({len(failures)} / {len(jobs)}):")
+        for key, error in failures.items():
+            print(f"  {key}: {error}")
+    return failures
+
+def watch(metadata_file_path, metadata_file_sheets, data_file_paths, interval=WATCH_INTERVAL, settle=WATCH_SETTLE,
+          chunksize=None, workers=None, full=False, append=False, report=None, after_pass=None):
+    """
+    Keeps OUTDIR up to date with the raw folders until interrupted.
+    After one pass over every station, the raw folders are polled every `interval` seconds by a
+    FolderWatcher, which stats the files instead of reading them, and only the stations whose
+    files are new or changed, and have not been modified for `settle` seconds, are processed again.
+    A change of the metadata workbook brings every station up to date. A pass stopped by an error,
+    e.g. a workbook read while it is being saved, is reported and retried after the next poll.
+
+    Args:
+        metadata_file_path (str): The path to the Excel file containing metadata.
+        metadata_file_sheets (list): The names of the sheets to read from the Excel file.
+        data_file_paths (list): The raw folders to watch, one per sheet.
+        interval (float): The seconds between polls.
+        settle (float): The seconds a raw file must be left unmodified before it is processed.
+        chunksize, workers, full, append, report: As for preprocess(); `full` only applies to the first pass.
+        after_pass (callable): Called with the failures of every pass that processed stations and
+                               the outputs it wrote or removed, e.g. to save the run report.
+    """
+    def workbook_signature():
+        stat = os.stat(metadata_file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def run_pass(only, full=False):
+        # failures of single stations are reported by preprocess() without stopping the pass
+        try:
+            written = set()
+            failures = preprocess(metadata_file_path, metadata_file_sheets, data_file_paths, chunksize, workers,
+                                  full, append, report, only=only, changed=written)
+            if after_pass:
+                after_pass(failures, written)
+            return True
+        except Exception as e:
+            print(f"PASS FAILED, RETRYING AFTER THE NEXT POLL: {type(e).__name__}: {e}")
+            return False
+
+    watcher = FolderWatcher(data_file_paths, settle=settle)
+    watcher.prime()
+    workbook = workbook_signature()
+    # the raw files of a failed pass, or None if every station is to be brought up to date
+    pending = set() if run_pass(None, full) else None
+    print(f"WATCHING {len(data_file_paths)} FOLDERS EVERY {interval} S, CTRL+C TO STOP")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                changed = watcher.poll()
+                signature = workbook_signature()
+            except OSError as e:
+                print(f"POLL FAILED, RETRYING: {type(e).__name__}: {e}")
+                continue
+            if signature != workbook and time.time_ns() - signature[1] >= settle * 1e9:
+                print("METADATA CHANGED")
+                workbook, pending = signature, None
+            elif pending is not None and not changed and not pending:
+                continue
+            if changed:
+                print("CHANGED FILES:", len(changed))
+            only = None if pending is None else pending | set(changed)
+            pending = set() if run_pass(only) else only
+    except KeyboardInterrupt:
+        print("WATCH STOPPED")
+
+def build_network_store(folder):
+  """
+  Brings the network store of one resolution folder up to date with its processed files, read
+  back by SoilMoistureData(folder, store=True). Only the files that changed since the store was
+  written are read, one at a time; the other series are copied from the store.
+
+  Args:
+      folder (str): The resolution folder.
+
+  Returns:
+      str: The path of the store file, or None if it was already up to date.
+  """
+  from witsms_reader import SoilMoistureData
+  data = SoilMoistureData(folder, lazy=True)
+  data.read_data()
+  return data.export_store()
 
 def remove_empty_files(directory):
   """
   Removes empty CSV files (containing only headers) from a directory and its subdirectories.
+  Processing no longer writes such files; this cleans up trees written by earlier versions.
 
   Args:
       directory (str): The directory path to search for CSV files.
   """
-  for filename in glob.iglob(os.path.join(directory, '**/*.csv'), recursive=True):
-    if os.path.getsize(filename) == 0:
-      # Empty file, remove it
-      os.remove(filename)
-      print(f"Removed empty CSV: {filename}")
-    else:
-      # Check for header only (read first line)
-      if has_one_row(filename):
+  with stage('remove_empty_files') as timing:
+    checked = removed = 0
+    for filename in glob.iglob(os.path.join(directory, '**/*.csv'), recursive=True):
+      checked += 1
+      if os.path.getsize(filename) == 0:
+        # Empty file, remove it
         os.remove(filename)
-        print(f"Removed CSV with only header: {filename}")
+        removed += 1
+        print(f"Removed empty CSV: {filename}")
+      else:
+        # Check for header only (read first line)
+        if has_one_row(filename):
+          os.remove(filename)
+          removed += 1
+          print(f"Removed CSV with only header: {filename}")
+    # counted in files rather than rows
+    timing.rows_in, timing.rows_out = checked, checked - removed
 
 import csv
 
@@ -310,6 +1408,18 @@ def has_one_row(filename):
     return False  # Assume not one row on error
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Process raw soil moisture data.')
+    parser.add_argument('--chunksize', type=int, default=None, help='Read raw files in chunks of this many rows to bound memory; averages match an unchunked run for files in time order')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to process stations in parallel')
+    parser.add_argument('--full', action='store_true', help='Reprocess every station, even if unchanged since the last run')
+    parser.add_argument('--append', action='store_true', help='Treat raw files as append-only and re-aggregate only the new rows of grown files')
+    parser.add_argument('--report', default=None, help='Record the time and rows of every processing stage and save them to this .json or .csv file')
+    parser.add_argument('--store', action='store_true', help='Pack each resolution into one memory-mappable network store after processing')
+    parser.add_argument('--slowest', type=int, default=10, help='Number of slowest stations to list with --report')
+    parser.add_argument('--watch', action='store_true', help='Keep running and process new or changed raw files as they arrive')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='Seconds between polls of the raw folders with --watch')
+    parser.add_argument('--remove-empty', action='store_true', help='Remove header-only CSV files left in OUTDIR by earlier versions')
+    args = parser.parse_args()
 
     # Define the data file paths using absolute paths
     DATA_FILE_PATHS = []
@@ -318,6 +1428,34 @@ if __name__ == "__main__":
         DATA_FILE_PATH = os.path.join(INDIR, str(year))
         DATA_FILE_PATHS.append(DATA_FILE_PATH)
 
+    report = RunReport() if args.report else None
+
+    def after_pass(failures, changed):
+        if report:
+            report.save(args.report)
+            report.print_summary(args.slowest)
+            print("RUN REPORT SAVED:", args.report)
+        if args.store:
+            # checked against the files rather than this pass's outputs, so that files rewritten by
+            # a run without --store, or one stopped before this point, are caught up too
+            for resolution in RESOLUTIONS.values():
+                folder = os.path.join(OUTDIR, resolution.folder)
+                if os.path.isdir(folder):
+                    path = build_network_store(folder)
+                    if path:
+                        print("NETWORK STORE SAVED:", path)
+
+    if args.remove_empty:
+        if report:
+            with report.recording():
+                remove_empty_files(OUTDIR)
+        else:
+            remove_empty_files(OUTDIR)
     # Call your functions with the absolute paths
-    preprocess(METADATA_FILE_PATH, METADATA_FILE_SHEETS_YEARS, DATA_FILE_PATHS)
-    remove_empty_files(OUTDIR)
\ No newline at end of file
+    if args.watch:
+        watch(METADATA_FILE_PATH, METADATA_FILE_SHEETS_YEARS, DATA_FILE_PATHS, args.interval, WATCH_SETTLE,
+              args.chunksize, args.workers, args.full, args.append, report, after_pass)
+    else:
+        changed = set()
+        preprocess(METADATA_FILE_PATH, METADATA_FILE_SHEETS_YEARS, DATA_FILE_PATHS, args.chunksize, args.workers, args.full, args.append, report, changed=changed)
+        after_pass(None, changed)
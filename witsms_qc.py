@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# Quality control flag bits; a reading's flag is the sum of the checks it fails, 0 if it passes all
+QC_NAN = 1
+QC_RANGE = 2
+QC_SPIKE = 4
+QC_RATE = 8
+QC_FLATLINE = 16
+
+# Checks that compare a reading with its neighbours in time
+NEIGHBOUR_FLAGS = QC_SPIKE | QC_RATE | QC_FLATLINE
+
+
+def qc_flags(timestamps, values, lower, upper, spike_threshold=None, spike_window=5, max_rate=None, flatline_length=None):
+    """
+    Evaluates every quality control check on one sensor column in a single vectorized pass.
+    The spike, rate-of-change and flat-line checks only look at the readings that are present
+    and within range, in the order given, which must be time order.
+
+    Args:
+        timestamps: int64 epoch nanoseconds of the readings; only needed for the rate-of-change check.
+        values: float array of the readings.
+        lower: The lowest valid reading.
+        upper: The highest valid reading.
+        spike_threshold: Flag readings further than this from the centred rolling median of
+                         spike_window readings. None disables the check.
+        spike_window: The number of readings in the rolling median window.
+        max_rate: Flag readings that changed faster than this per hour since the previous reading.
+                  None disables the check.
+        flatline_length: Flag runs of at least this many identical consecutive readings, as from a
+                         stuck sensor. None disables the check.
+
+    Returns:
+        np.ndarray: The uint8 flag of every reading, a combination of the QC_* bits.
+    """
+    values = np.asarray(values, dtype='float64')
+    flags = np.zeros(len(values), dtype='uint8')
+    missing = np.isnan(values)
+    flags[missing] |= QC_NAN
+    flags[~missing & ((values > upper) | (values < lower))] |= QC_RANGE
+    if spike_threshold is None and max_rate is None and not flatline_length:
+        return flags
+
+    valid = np.flatnonzero(flags == 0)
+    readings = values[valid]
+    if spike_threshold is not None and len(readings):
+        median = pd.Series(readings).rolling(spike_window, center=True, min_periods=1).median().to_numpy()
+        flags[valid[np.abs(readings - median) > spike_threshold]] |= QC_SPIKE
+    if max_rate is not None and len(readings) > 1:
+        hours = np.diff(np.asarray(timestamps, dtype='int64')[valid]) / 3.6e12
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.abs(np.diff(readings)) / hours
+        flags[valid[1:][rate > max_rate]] |= QC_RATE
+    if flatline_length and len(readings):
+        starts = np.flatnonzero(np.diff(readings, prepend=np.nan) != 0)
+        lengths = np.diff(np.append(starts, len(readings)))
+        flags[valid[np.repeat(lengths >= flatline_length, lengths)]] |= QC_FLATLINE
+    return flags
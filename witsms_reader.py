@@ -1,122 +1,606 @@
 import os
 import re
-import datetime
 import csv
+import numpy as np
 import matplotlib.pyplot as plt
 import argparse  # New import for command-line arguments
+import pandas as pd
+from collections import OrderedDict
 
 from config import SMS_PATH
+from witsms_spatial import StationIndex
+from witsms_plotting import render_plots, downsample, DEFAULT_MAX_POINTS
+from witsms_store import NetworkStore, write_store, STORE_FILE
+
+# Processed file extensions, in order of preference
+FILE_EXTENSIONS = ['.parquet', '.feather', '.csv']
  
+# Default memory bound of the series held by a lazily read SoilMoistureData
+DEFAULT_CACHE_BYTES = 512 * 1024 ** 2
+
+# Distance in km within which a latitude/longitude lookup matches a station
+LOCATION_TOLERANCE_KM = 0.01
+
+# gpi, latitude and longitude encoded in the processed file names
+FILENAME_PATTERN = re.compile(r'gpi=(\d+)_lat=([-+]?[0-9]*\.?[0-9]+)_lon=([-+]?[0-9]*\.?[0-9]+)')
+
+
+def load_series(file_path, dtype='float64'):
+    """
+    Loads a processed file in bulk as a datetime64[ns] timestamp array and a soil moisture array
+    on the 0-1 scale, skipping the rows without a soil moisture value.
+    CSV files are parsed by pandas' C reader; Parquet and Feather files are already typed.
+    """
+    if file_path.endswith(".parquet"):
+        df = pd.read_parquet(file_path)
+    elif file_path.endswith(".feather"):
+        df = pd.read_feather(file_path)
+    else:
+        df = pd.read_csv(file_path, usecols=[0, 1])
+    timestamps = pd.to_datetime(df.iloc[:, 0], format='ISO8601', errors='coerce').to_numpy(dtype='datetime64[ns]')
+    soil_moistures = df.iloc[:, 1].to_numpy(dtype='float64') / 100  # coverting to 0-1 scale
+    valid = ~np.isnan(soil_moistures)  # Ensuring the soil moisture value is not empty
+    unparsed = valid & np.isnat(timestamps)
+    if unparsed.any():
+        print(f"Error parsing {unparsed.sum()} timestamps in {os.path.basename(file_path)}")  # Error output
+    valid &= ~unparsed
+    timestamps, soil_moistures = timestamps[valid], soil_moistures[valid].astype(dtype)
+    # Time windows are found by binary search, so the series must be in time order
+    if (timestamps[1:] < timestamps[:-1]).any():
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, soil_moistures = timestamps[order], soil_moistures[order]
+    return timestamps, soil_moistures
+
+def file_metadata(file):
+    """
+    Returns the metadata entry of a processed file from its name alone; the dates, count and
+    overlaps are None until the series is loaded.
+    """
+    gpi, lat, lon = FILENAME_PATTERN.search(file).groups()
+    return {
+        'gpi': gpi,
+        'latitude': lat,
+        'longitude': lon,
+        'start_date': None,
+        'end_date': None,
+        'count': None, 
+        'overlaps': None
+    }
+
+def series_nbytes(series):
+    """
+    Returns the memory held by the arrays of a (timestamps, soil_moistures) series.
+    """
+    return sum(array.nbytes for array in series)
+
+def to_datetime64(value):
+    """
+    Converts a date string, datetime or datetime64 to datetime64[ns]; None stays None.
+    """
+    return None if value is None else pd.Timestamp(value).to_datetime64().astype('datetime64[ns]')
+
+def slice_window(timestamps, soil_moistures, start=None, end=None):
+    """
+    Returns the part of a time-ordered series in the window [start, end), found by binary search.
+    A missing start or end leaves that side of the window open.
+    """
+    lo = 0 if start is None else np.searchsorted(timestamps, to_datetime64(start), side='left')
+    hi = len(timestamps) if end is None else np.searchsorted(timestamps, to_datetime64(end), side='left')
+    return timestamps[lo:hi], soil_moistures[lo:hi]
+
+def count_overlaps(starts, ends):
+    """
+    Counts, for every interval [start, end], how many of the other intervals share part of it.
+    Interval j overlaps interval i if it starts before i ends and does not end before i starts,
+    so both counts are found by binary search in the sorted starts and ends: O(n log n).
+    """
+    started = np.searchsorted(np.sort(starts), ends, side='right')
+    ended = np.searchsorted(np.sort(ends), starts, side='left')
+    return started - ended - 1
+
+def coverage_bins(timestamps, freq):
+    """
+    Returns the sorted, unique int64 indices of the intervals of width freq holding a value.
+    """
+    width = pd.Timedelta(freq).value
+    return np.unique(timestamps.astype('datetime64[ns]').view('int64') // width)
+
+def count_shared_bins(bins):
+    """
+    Counts, for every station, how many of the other stations have a value in at least one of
+    the same intervals, without a station x interval matrix. The sorted interval indices of each
+    station are merged into runs of consecutive intervals, and a sweep over the starts and ends
+    of all runs in time order keeps the set of stations with a value, as a bitset. Two stations
+    share an interval exactly when one of them starts a run while the other has a value, so every
+    run start adds the current set to the partners of its station.
+
+    Args:
+        bins: One sorted, unique int64 array of interval indices per station, as from coverage_bins().
+
+    Returns:
+        np.ndarray: The number of other stations sharing an interval with each station.
+    """
+    positions, kinds, owners = [], [], []
+    for station, station_bins in enumerate(bins):
+        if not len(station_bins):
+            continue
+        breaks = np.flatnonzero(np.diff(station_bins) != 1)
+        firsts, lasts = station_bins[np.r_[0, breaks + 1]], station_bins[np.r_[breaks, len(station_bins) - 1]]
+        # a run ends just after its last interval; at equal positions ends sort before starts
+        positions += [firsts, lasts + 1]
+        kinds += [np.ones(len(firsts), dtype='int8'), np.zeros(len(lasts), dtype='int8')]
+        owners += [np.full(len(firsts), station), np.full(len(lasts), station)]
+    partners = [0] * len(bins)
+    if positions:
+        positions, kinds, owners = np.concatenate(positions), np.concatenate(kinds), np.concatenate(owners)
+        order = np.lexsort((kinds, positions))
+        active = 0
+        for starts, station in zip(kinds[order].tolist(), owners[order].tolist()):
+            if starts:
+                partners[station] |= active
+                active |= 1 << station
+            else:
+                active &= ~(1 << station)
+    # the partners found at run starts, made symmetric
+    size = (len(bins) + 7) // 8
+    shared = np.unpackbits(np.frombuffer(b"".join(p.to_bytes(size, 'little') for p in partners), dtype='uint8')
+                           .reshape(len(bins), size), axis=1, bitorder='little')[:, :len(bins)].astype(bool)
+    return (shared | shared.T).sum(axis=1)
+
+def to_lists(timestamps, soil_moistures):
+    """
+    Converts timestamp and soil moisture arrays to lists of datetime objects and floats.
+    """
+    return timestamps.astype('datetime64[us]').tolist(), soil_moistures.tolist()
+
+
+class StationCache:
+    """
+    A read-only sequence of (timestamps, soil_moistures) per station file that loads each series
+    on first access and keeps the most recently used ones in memory, up to max_bytes in total.
+    """
+    def __init__(self, paths, dtype='float64', max_bytes=DEFAULT_CACHE_BYTES, on_load=None):
+        self.paths = paths
+        self.dtype = dtype
+        self.max_bytes = max_bytes
+        self.on_load = on_load  # called with (index, series) whenever a series is read from disk
+        self.nbytes = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        index = range(len(self.paths))[index]
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        series = load_series(self.paths[index], self.dtype)
+        if self.on_load:
+            self.on_load(index, series)
+        self._cache[index] = series
+        self.nbytes += series_nbytes(series)
+        # Evict the least recently used series, always keeping the one just loaded
+        while self.nbytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self.nbytes -= series_nbytes(evicted)
+        return series
+
+    def __iter__(self):
+        for index in range(len(self.paths)):
+            yield self[index]
+
 
 class SoilMoistureData:
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, dtype='float64', lazy=False, cache_bytes=DEFAULT_CACHE_BYTES, store=False):
         self.folder_path = folder_path
+        self.dtype = dtype  # dtype of the soil moisture arrays, e.g. 'float32' to halve memory
+        self.lazy = lazy  # index the files by name only and load each series when it is first used
+        self.cache_bytes = cache_bytes  # memory bound of the lazily loaded series
+        self.store = store  # memory-map the folder's network store instead of reading the files; values are float32
         self.data = []
         self.metadata = []
+        self.paths = []  # file path of every station, in the order of data and metadata
         self.total_files = 0
+        self.gpi_index = {}  # gpi -> position in data and metadata
+        self.spatial_index = None  # StationIndex over the station coordinates
+
+    def list_files(self):
+        """
+        Returns one processed file per station in the folder. A station saved as Parquet or
+        Feather as well as CSV is read from the binary file, which needs no text parsing.
+        """
+        files = {}
+        for f in sorted(os.listdir(self.folder_path)):
+            stem, ext = os.path.splitext(f)
+            if 'witsms_gpi' in f and ext in FILE_EXTENSIONS:
+                if stem not in files or FILE_EXTENSIONS.index(ext) < FILE_EXTENSIONS.index(os.path.splitext(files[stem])[1]):
+                    files[stem] = f
+        return list(files.values())
 
     def read_data(self):
-        files = [f for f in os.listdir(self.folder_path) if f.endswith(".csv") and 'witsms_gpi' in f]
+        if self.store:
+            self._open_store()
+            return
+
+        files = self.list_files()
         self.total_files = len(files)
-        print(f"Reading {self.total_files} files...")  # Debugging output
 
+        if self.lazy:
+            # gpi, lat and lon come from the file names; dates and counts are filled in on loading
+            print(f"Indexing {self.total_files} files...")  # Debugging output
+            self.metadata = [file_metadata(file) for file in files]
+            self.paths = [os.path.join(self.folder_path, file) for file in files]
+            self.data = StationCache(self.paths, self.dtype, self.cache_bytes, self._update_metadata)
+            self._build_indexes()
+            return
+
+        print(f"Reading {self.total_files} files...")  # Debugging output
         for file in files:
             file_path = os.path.join(self.folder_path, file)
-            gpi = re.search(r'gpi=(\d+)', file).group(1)
-            lat = re.search(r'lat=([-+]?[0-9]*\.?[0-9]+)', file).group(1)
-            lon = re.search(r'lon=([-+]?[0-9]*\.?[0-9]+)', file).group(1)
-            timestamps = []
-            soil_moistures = []
-
-            with open(file_path, 'r') as csvfile:
-                reader = csv.reader(csvfile)
-                next(reader)  # Skip header
-                for col in reader:
-                    if col[1]:  # Ensuring the soil moisture value is not empty
-                        try:
-                            timestamp = datetime.datetime.strptime(col[0], "%Y-%m-%d %H:%M:%S")
-                            soil_moisture = float(col[1]) / 100 # coverting to 0-1 scale
-                            timestamps.append(timestamp)
-                            soil_moistures.append(soil_moisture)
-                        except ValueError as e:
-                            print(f"Error parsing line in {file}: {e}")  # Error output
+            timestamps, soil_moistures = load_series(file_path, self.dtype)
 
             # Ensure data is not empty before appending
-            if timestamps:
-                self.data.append((timestamps, soil_moistures))  # Storing timestamps and soil moisture values
-                start_date = min(timestamps).strftime("%Y-%m-%d")
-                end_date = max(timestamps).strftime("%Y-%m-%d")
-                count_soil_moisture = len(soil_moistures)
-                self.metadata.append({
-                    'gpi': gpi,
-                    'latitude': lat,
-                    'longitude': lon,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'count': count_soil_moisture, 
-                    'overlaps': 0
-                })
-
-    def print_metadata(self):
+            if len(timestamps):
+                self.data.append((timestamps, soil_moistures))  # Storing timestamps and soil moisture arrays
+                self.metadata.append(file_metadata(file))
+                self.paths.append(file_path)
+                self._update_metadata(len(self.metadata) - 1, (timestamps, soil_moistures))
+        self._build_indexes()
+        self.count_overlaps()
+
+    def _open_store(self):
+        # One file open; the series are views into the mapped store and the dates come from its first and last rows
+        store = NetworkStore(os.path.join(self.folder_path, STORE_FILE))
+        print(f"Opening store of {len(store)} stations...")  # Debugging output
+        self.total_files = len(store)
+        self.data = store
+        self.paths = [os.path.join(self.folder_path, station['name']) for station in store.stations]
+        self.metadata = []
+        for station, (timestamps, soil_moistures) in zip(store.stations, store):
+            self.metadata.append({
+                'gpi': station['gpi'],
+                'latitude': station['latitude'],
+                'longitude': station['longitude'],
+                'start_date': str(timestamps[0].astype('datetime64[D]')),
+                'end_date': str(timestamps[-1].astype('datetime64[D]')),
+                'count': station['length'],
+                'overlaps': None
+            })
+        self._build_indexes()
+        self.count_overlaps()
+
+    def export_store(self, path=None):
+        """
+        Packs the series of all stations with data into one memory-mappable store file, by default
+        in the data folder, where SoilMoistureData(folder, store=True) opens it.
+
+        The store records the size and mtime of every file it was built from. If a store already
+        exists at `path`, the series of the stations whose files still match it are copied from it
+        instead of being read again, and a store that matches every file is left as it is. On
+        Windows the store cannot be replaced while another process has it open, e.g.
+        witsms_service.py --store; PermissionError is raised and the old store is kept.
+
+        Args:
+            path (str): The path of the store file.
+
+        Returns:
+            str: The path of the store file, or None if it was already up to date.
+        """
+        path = path or os.path.join(self.folder_path, STORE_FILE)
+        names, sources = [], []
+        for file_path in self.paths:
+            stat = os.stat(file_path)
+            names.append(os.path.basename(file_path))
+            sources.append((stat.st_size, stat.st_mtime_ns))
+        previous, reuse = None, {}
+        if os.path.exists(path):
+            previous = NetworkStore(path)
+            current = dict(zip(names, sources))
+            reuse = {station['name']: index for index, station in enumerate(previous.stations)
+                     if current.get(station['name']) == (station.get('size'), station.get('mtime_ns'))}
+            # up to date if no stored series is stale or gone and the files it lacks are still empty
+            if len(reuse) == len(previous) and all(not len(self.data[index][0]) for index, name in enumerate(names) if name not in reuse):
+                return None
+        def stations():
+            for index, meta in enumerate(self.metadata):
+                timestamps, soil_moistures = previous[reuse[names[index]]] if names[index] in reuse else self.data[index]
+                if len(timestamps):
+                    yield names[index], meta, timestamps, soil_moistures, sources[index]
+        # the old store stays mapped while it is copied, so the new one replaces it only once it is closed
+        write_store(path + '.new', stations())
+        previous = reuse = None
+        try:
+            os.replace(path + '.new', path)
+        except PermissionError as e:
+            # on Windows, while another process (e.g. witsms_service.py --store) has the store mapped
+            os.remove(path + '.new')
+            raise PermissionError(f"Cannot replace {path}, it is open in another process; stop the "
+                                  f"processes reading it and build the store again") from e
+        return path
+
+    def _build_indexes(self):
+        self.gpi_index = {meta['gpi']: index for index, meta in enumerate(self.metadata)}
+        self.spatial_index = StationIndex([float(meta['latitude']) for meta in self.metadata],
+                                          [float(meta['longitude']) for meta in self.metadata])
+
+    def _update_metadata(self, index, series):
+        timestamps, soil_moistures = series
+        self.metadata[index].update({
+            'start_date': str(timestamps.min().astype('datetime64[D]')) if len(timestamps) else None,
+            'end_date': str(timestamps.max().astype('datetime64[D]')) if len(timestamps) else None,
+            'count': len(soil_moistures),
+        })
+
+    def _find(self, gpi):
+        return self.gpi_index.get(str(gpi))
+
+    def _find_location(self, lat, lon, tolerance_km=LOCATION_TOLERANCE_KM):
+        # Coordinates are compared as numbers, so 31.5 matches a station at 31.50
+        positions, distances = self.spatial_index.nearest(float(lat), float(lon))
+        if len(positions) and distances[0] <= tolerance_km:
+            return int(positions[0])
+        return None
+
+    def get_station_metadata(self, gpi):
+        """
+        Returns the metadata of one station, loading only that station if it is read lazily.
+        """
+        index = self._find(gpi)
+        if index is None:
+            return None
+        if self.metadata[index]['count'] is None:
+            self.data[index]
+        return self.metadata[index]
+
+    def _loaded_metadata(self):
+        # Lazily read stations are loaded one at a time through the cache to fill in their dates and counts
+        loaded = False
+        for index, meta in enumerate(self.metadata):
+            if meta['count'] is None:
+                self.data[index]
+                loaded = True
+        if loaded:
+            self.count_overlaps()
+        return [meta for meta in self.metadata if meta['count']]
+
+    def _date_ranges(self):
+        # positions, first and last days of the stations with data; lazily read stations are loaded
+        self._loaded_metadata()
+        positions = [index for index, meta in enumerate(self.metadata) if meta['count']]
+        starts = np.array([self.metadata[index]['start_date'] for index in positions], dtype='datetime64[D]')
+        ends = np.array([self.metadata[index]['end_date'] for index in positions], dtype='datetime64[D]')
+        return positions, starts, ends
+
+    def count_overlaps(self, resolution=None):
+        """
+        Sets the 'overlaps' metadata of every station to the number of other stations with data
+        in the same period.
+
+        Args:
+            resolution: None to compare the stations' start and end dates, found with a sweep over
+                        the sorted dates in O(n log n). A frequency such as '1D' compares the
+                        intervals of that width in which the stations actually have values instead,
+                        found with a sweep over the runs of those intervals by count_shared_bins().
+        """
+        positions, starts, ends = self._date_ranges()
+        if resolution is None:
+            counts = count_overlaps(starts, ends)
+        else:
+            counts = count_shared_bins([coverage_bins(self.data[index][0], resolution) for index in positions])
+        for index, count in zip(positions, counts.tolist()):
+            self.metadata[index]['overlaps'] = count
+
+    def _overlap_matrix(self, resolution=None):
+        positions, starts, ends = self._date_ranges()
+        if resolution is None:
+            # days shared by the date ranges, both ends included
+            shared = np.minimum(ends[:, None], ends[None, :]) - np.maximum(starts[:, None], starts[None, :])
+            return positions, np.maximum(shared.astype('int64') + 1, 0).astype('float64')
+        # intervals with values shared by every pair of stations, via a dense station x interval
+        # incidence matrix; only built here, count_overlaps() does not need it
+        bins = [coverage_bins(self.data[index][0], resolution) for index in positions]
+        all_bins = np.unique(np.concatenate(bins)) if bins else np.array([], dtype='int64')
+        incidence = np.zeros((len(positions), len(all_bins)), dtype='float32')
+        for row, station_bins in enumerate(bins):
+            incidence[row, np.searchsorted(all_bins, station_bins)] = 1
+        shared = (incidence @ incidence.T).astype('float64')
+        return positions, shared * (pd.Timedelta(resolution) / pd.Timedelta('1D'))
+
+    def overlap_matrix(self, resolution=None):
+        """
+        Returns the pairwise overlap durations of the stations with data.
+
+        Args:
+            resolution: None for the days shared by the stations' date ranges, or a frequency such
+                        as '1h' for the time covered by the intervals of that width in which both
+                        stations have values.
+
+        Returns:
+            The gpis of the stations and a square array of the overlap durations in days; the
+            diagonal holds each station's own duration.
+        """
+        positions, matrix = self._overlap_matrix(resolution)
+        return [self.metadata[index]['gpi'] for index in positions], matrix
+
+    def stations_active_at(self, instant, resolution=None):
+        """
+        Returns the gpis of the stations with data at an instant: whose date range includes its day,
+        or, with a resolution such as '1h', that have a value in the interval of that width holding it.
+        """
+        instant = to_datetime64(instant)
+        positions, starts, ends = self._date_ranges()
+        day = instant.astype('datetime64[D]')
+        active = [positions[i] for i in np.flatnonzero((starts <= day) & (ends >= day))]
+        if resolution is not None:
+            width = pd.Timedelta(resolution).value
+            first = instant.view('int64') - instant.view('int64') % width
+            window = (np.int64(first).view('datetime64[ns]'), np.int64(first + width).view('datetime64[ns]'))
+            active = [index for index in active if np.searchsorted(self.data[index][0], window[0]) < np.searchsorted(self.data[index][0], window[1])]
+        return [self.metadata[index]['gpi'] for index in active]
+
+    def print_metadata(self, gpi=None):
         headers = ['gpi', 'latitude', 'longitude', 'start_date', 'end_date', 'count', 'overlaps']
         print(",".join(headers))
-        for entry in self.metadata:
-            row = [entry[header] for header in headers]
-            print(",".join(map(str, row)))
+        entries = [self.get_station_metadata(gpi)] if gpi else self._loaded_metadata()
+        for entry in entries:
+            if entry:
+                # overlaps are blank for a station loaded on its own, as in save_metadata_to_csv()
+                row = ['' if entry[header] is None else entry[header] for header in headers]
+                print(",".join(map(str, row)))
     
     def get_metadata(self):
         """
         Returns the metadata as a list of dictionaries.
         Each dictionary contains the metadata of one dataset.
         """
-        return self.metadata
+        return self._loaded_metadata()
 
     def save_metadata_to_csv(self, filename='metadata.csv'):
         headers = ['gpi', 'latitude', 'longitude', 'start_date', 'end_date', 'count', 'overlaps']
         with open(filename, 'w', newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=headers)
             writer.writeheader()
-            for entry in self.metadata:
+            for entry in self._loaded_metadata():
                 writer.writerow(entry)
     
     def get_lat_lon_by_gpi(self, gpi):
-        for item in self.metadata:
-            if item['gpi'] == gpi:
-                return (item['latitude'], item['longitude'])
-        return None  # Return None if no matching GPI is found  
+        index = self._find(gpi)
+        if index is None:
+            return None  # Return None if no matching GPI is found
+        return (self.metadata[index]['latitude'], self.metadata[index]['longitude'])
+
+    def nearest_stations(self, lat, lon, k=1):
+        """
+        Returns the k stations nearest to a point as a list of (gpi, distance in km), nearest first.
+        """
+        positions, distances = self.spatial_index.nearest(float(lat), float(lon), k)
+        return [(self.metadata[i]['gpi'], d) for i, d in zip(positions.tolist(), distances.tolist())]
+
+    def stations_within_radius(self, lat, lon, radius_km):
+        """
+        Returns the stations within radius_km of a point as a list of (gpi, distance in km), nearest first.
+        """
+        positions, distances = self.spatial_index.within_radius(float(lat), float(lon), radius_km)
+        return [(self.metadata[i]['gpi'], d) for i, d in zip(positions.tolist(), distances.tolist())]
+
+    def stations_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Returns the gpis of the stations inside a latitude/longitude box, bounds included.
+        """
+        return [self.metadata[i]['gpi'] for i in self.spatial_index.in_bbox(min_lat, min_lon, max_lat, max_lon)]
+
+    def match_points(self, lats, lons, max_distance_km=None):
+        """
+        Matches many points, e.g. satellite grid points, to their nearest station.
+
+        Args:
+            lats: Latitudes of the points.
+            lons: Longitudes of the points.
+            max_distance_km: Points farther than this from every station get no match.
 
-    def get_soil_moisture_by_location(self, lat=None, lon=None, gpi=None):
+        Returns:
+            A list with the matched gpi (or None) per point and an array of the distances in km.
+        """
+        gpis, distances = [], np.full(len(lats), np.nan)
+        for n, (lat, lon) in enumerate(zip(lats, lons)):
+            positions, found = self.spatial_index.nearest(float(lat), float(lon))
+            if len(positions) and (max_distance_km is None or found[0] <= max_distance_km):
+                gpis.append(self.metadata[positions[0]]['gpi'])
+                distances[n] = found[0]
+            else:
+                gpis.append(None)
+        return gpis, distances
+
+    def get_soil_moisture_by_location(self, lat=None, lon=None, gpi=None, as_lists=False):
+        """
+        Returns the timestamps (datetime64[ns]) and soil moisture arrays of a station, found by GPI
+        or by latitude and longitude (within LOCATION_TOLERANCE_KM). With as_lists=True they are returned as lists of datetime
+        objects and floats instead, as in earlier versions.
+        """
+        index = None
         if gpi:  # Get data by GPI if provided
-            for (timestamps, soil_moistures), meta in zip(self.data, self.metadata):
-                if meta['gpi'] == gpi:
-                    return timestamps, soil_moistures
+            index = self._find(gpi)
         elif lat and lon:  # Get data by latitude and longitude
-            for (timestamps, soil_moistures), meta in zip(self.data, self.metadata):
-                if meta['latitude'] == str(lat) and meta['longitude'] == str(lon):
-                    return timestamps, soil_moistures
-        return None, None  # Return None if no data is found
+            index = self._find_location(lat, lon)
+        if index is None:
+            return None, None  # Return None if no data is found
+        timestamps, soil_moistures = self.data[index]
+        return to_lists(timestamps, soil_moistures) if as_lists else (timestamps, soil_moistures)
+
+    def get_window(self, gpi, start=None, end=None):
+        """
+        Returns the timestamps and soil moisture arrays of a station in the window [start, end),
+        or (None, None) if the GPI is not available. start and end may be date strings or datetimes.
+        """
+        index = self._find(gpi)
+        if index is None:
+            return None, None
+        timestamps, soil_moistures = self.data[index]
+        return slice_window(timestamps, soil_moistures, start, end)
+
+    def extract(self, gpis, start=None, end=None):
+        """
+        Returns a dict of gpi -> (timestamps, soil_moistures) in the window [start, end) for the
+        given GPIs. GPIs that are not available are left out.
+        """
+        series = {}
+        for gpi in gpis:
+            timestamps, soil_moistures = self.get_window(gpi, start, end)
+            if timestamps is not None:
+                series[str(gpi)] = (timestamps, soil_moistures)
+        return series
 
-    def plot_data_gpi(self, gpi=None):
-        # Plot data only for the specified GPI
+    def extract_aligned(self, gpis, start=None, end=None, as_dataframe=False):
+        """
+        Extracts the given GPIs in the window [start, end) on a common time axis.
+
+        Args:
+            gpis: GPIs to extract; GPIs that are not available are left out.
+            start: Start of the window, included. None leaves it open.
+            end: End of the window, excluded. None leaves it open.
+            as_dataframe: Return a DataFrame indexed by time with one column per GPI.
+
+        Returns:
+            The time axis (the union of the stations' timestamps), a 2-D array with one row per
+            time and one column per GPI holding NaN where a station has no value, and the GPIs of
+            the columns; or the equivalent DataFrame if as_dataframe is True.
+        """
+        series = self.extract(gpis, start, end)
+        columns = list(series)
+        if series:
+            axis = np.unique(np.concatenate([timestamps for timestamps, _ in series.values()]))
+        else:
+            axis = np.array([], dtype='datetime64[ns]')
+        values = np.full((len(axis), len(columns)), np.nan, dtype=np.result_type(self.dtype, np.float32))
+        for column, (timestamps, soil_moistures) in enumerate(series.values()):
+            values[np.searchsorted(axis, timestamps), column] = soil_moistures
+        if as_dataframe:
+            return pd.DataFrame(values, index=pd.DatetimeIndex(axis, name='Date'), columns=columns)
+        return axis, values, columns
+
+    def plot_data_gpi(self, gpi=None, max_points=None):
+        # Plot data only for the specified GPI; max_points downsamples long series before drawing
         if gpi:
-            found = False
-            for (timestamps, soil_moistures), meta in zip(self.data, self.metadata):
-                if meta['gpi'] == gpi:
-                    plt.figure(figsize=(10, 6))
-                    plt.plot(timestamps, soil_moistures, label=f"GPI {meta['gpi']} at ({meta['latitude']}, {meta['longitude']})")
-                    plt.title(f"Soil Moisture Time Series for GPI {meta['gpi']} - Values: {meta['count']}")
-                    plt.xlabel('Date')
-                    plt.ylabel('Soil Moisture')
-                    plt.legend()
-                    plt.show()
-                    found = True
-                    break  # Stop after plotting the specified GPI
-            if not found:
+            index = self._find(gpi)
+            if index is None:
                 gpi_ = [meta['gpi'] for meta in self.metadata]
                 raise ValueError(f'GPI {gpi} not available in metadata. The available GPI are {gpi_}')
+            timestamps, soil_moistures = downsample(*self.data[index], max_points)
+            meta = self.metadata[index]
+            plt.figure(figsize=(10, 6))
+            plt.plot(timestamps, soil_moistures, label=f"GPI {meta['gpi']} at ({meta['latitude']}, {meta['longitude']})")
+            plt.title(f"Soil Moisture Time Series for GPI {meta['gpi']} - Values: {meta['count']}")
+            plt.xlabel('Date')
+            plt.ylabel('Soil Moisture')
+            plt.legend()
+            plt.show()
         else:
             # If no GPI is specified, plot all data
             for (timestamps, soil_moistures), meta in zip(self.data, self.metadata):
+                if not meta['count']:
+                    continue  # lazily read station without data
+                timestamps, soil_moistures = downsample(timestamps, soil_moistures, max_points)
                 plt.figure(figsize=(10, 6))
                 plt.plot(timestamps, soil_moistures, label=f"GPI {meta['gpi']} at ({meta['latitude']}, {meta['longitude']})")
                 plt.title(f"Soil Moisture Time Series for GPI {meta['gpi']} - Values: {meta['count']}")
@@ -125,28 +609,66 @@ class SoilMoistureData:
                 plt.legend()
                 plt.show()
 
+    def render_plots(self, output_dir, gpis=None, file_format='png', max_points=DEFAULT_MAX_POINTS, workers=None, overview=False):
+        """
+        Saves the plots of many stations to files instead of showing them, rendered in parallel.
+
+        Args:
+            output_dir (str): The directory to save the plots in, named like the processed files.
+            gpis (list): The GPIs to plot; all stations with data by default.
+            file_format (str): 'png' or 'svg'.
+            max_points (int): The number of points each series is downsampled to, keeping its shape.
+            workers (int): The number of processes rendering plots.
+            overview (bool): Also save overview sheets with many stations per page.
+
+        Returns:
+            list: The paths of the files written.
+        """
+        indices = range(len(self.metadata)) if gpis is None else [self._find(gpi) for gpi in gpis]
+        def stations():
+            for index in indices:
+                if index is None:
+                    continue
+                timestamps, soil_moistures = self.data[index]
+                if len(timestamps):
+                    name = os.path.splitext(os.path.basename(self.paths[index]))[0]
+                    yield name, timestamps, soil_moistures, self.metadata[index]
+        return render_plots(stations(), output_dir, file_format, max_points, workers, overview)
+
 
 if __name__ == "__main__":
     # Set up argument parsing
     parser = argparse.ArgumentParser(description='Process soil moisture data.')
-    parser.add_argument('--print-metadata', action='store_true', help='Print metadata in CSV format')
+    parser.add_argument('--print-metadata', nargs='?', const=True, default=False, metavar='GPI', help='Print metadata in CSV format, for all GPIs or a specific GPI')
     parser.add_argument('--save-metadata', action='store_true', help='Save metadata to a CSV file')
-    parser.add_argument('--plot-gpi', nargs='?', const=None, help='Plot data for a specific GPI')
+    parser.add_argument('--plot-gpi', nargs='?', const='', default=None, help='Plot data for a specific GPI, or all GPIs if none is specified')
+    parser.add_argument('--lazy', action='store_true', help='Load each station only when it is used')
+    parser.add_argument('--render', metavar='DIR', default=None, help='Save the plots of all GPIs, or of the --plot-gpi GPI, to files in DIR instead of showing them')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png', help='File format of the rendered plots')
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help='Number of points each plotted series is downsampled to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes rendering plots')
+    parser.add_argument('--overview', action='store_true', help='With --render, also save overview sheets of many GPIs per page')
+    parser.add_argument('--store', action='store_true', help='Read the network store of the folder instead of the processed files')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_BYTES // 1024 ** 2, help='Memory bound in MB of the stations held when loading lazily')
     
     args = parser.parse_args()
 
     # Initialize the SoilMoistureData class
-    soil_moisture_data = SoilMoistureData(SMS_PATH)
+    soil_moisture_data = SoilMoistureData(SMS_PATH, lazy=args.lazy, cache_bytes=args.cache_mb * 1024 ** 2, store=args.store)
     soil_moisture_data.read_data()
 
     # Handle the command-line arguments
     if args.print_metadata:
-        soil_moisture_data.print_metadata()  # Print metadata in CSV format
+        # Print metadata in CSV format
+        soil_moisture_data.print_metadata(None if args.print_metadata is True else args.print_metadata)
 
     if args.save_metadata:
         soil_moisture_data.save_metadata_to_csv()  # Save metadata to a CSV file
 
-    if args.plot_gpi is not None:
-        soil_moisture_data.plot_data_gpi(args.plot_gpi)  # Plot data for the specified GPI or all GPIs if none is specified
-    elif args.plot_gpi is None:
-        soil_moisture_data.plot_data_gpi() 
\ No newline at end of file
+    if args.render:
+        written = soil_moisture_data.render_plots(args.render, [args.plot_gpi] if args.plot_gpi else None,
+                                                  args.format, args.max_points, args.workers, args.overview)
+        print(f"Saved {len(written)} plots to {args.render}")
+    elif args.plot_gpi is not None:
+        # Plot data for the specified GPI or all GPIs if none is specified
+        soil_moisture_data.plot_data_gpi(args.plot_gpi or None, args.max_points)
\ No newline at end of file
@@ -0,0 +1,263 @@
+import os
+import io
+import csv
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from config import OUTDIR, SERVICE_HOST, SERVICE_PORT, SERVICE_CACHE_SIZE, SERVICE_CHECK_INTERVAL
+from witsms_reader import SoilMoistureData, FILE_EXTENSIONS
+from witsms_processing import RESOLUTIONS, get_resolution, accumulate
+from witsms_store import STORE_FILE
+
+
+def finest_resolution():
+    """Returns the name of the finest registered averaging interval, e.g. '30minute'."""
+    return min(RESOLUTIONS, key=lambda average: RESOLUTIONS[average].freq)
+
+def resample(timestamps, soil_moistures, average, base=None):
+    """
+    Averages a time-ordered series into the intervals of a registered resolution with accumulate(),
+    as the processed files are: every value is keyed by the start of its interval plus the
+    resolution's offset, intervals without data are filled in with NaN where the resolution
+    requires it, and the averages are rounded to 3 decimals of a percent.
+
+    The series is expected to hold the averages of the `base` resolution, so the result is the
+    mean of those averages; intervals of the base resolution cannot be split any finer.
+
+    Args:
+        timestamps: datetime64[ns] array of the series, in time order.
+        soil_moistures: The soil moistures, on the 0-1 scale.
+        average: The name of the resolution to average into, e.g. 'daily'.
+        base: The name of the resolution the series holds; defaults to the finest registered one.
+
+    Returns:
+        tuple: The interval timestamps and their averages (float64).
+    """
+    base = base or finest_resolution()
+    base_resolution = get_resolution(base)
+    if get_resolution(average).freq < base_resolution.freq:
+        raise ValueError(f"Cannot resample {base} data to the finer '{average}'")
+    if average == base:
+        return timestamps, np.asarray(soil_moistures, dtype='float64')
+    if not len(timestamps):
+        return timestamps, np.empty(0)
+    # values are keyed by the start of their base interval, not its offset timestamp, and are
+    # averaged in percent, the unit of the processed files, so the rounding matches theirs
+    df = pd.DataFrame({'TimeStamp': timestamps - base_resolution.offset.to_timedelta64(),
+                       'SoilMoisture': np.asarray(soil_moistures, dtype='float64') * 100})
+    result = accumulate(df, ['SoilMoisture'], 'TimeStamp', average)
+    return result['TimeStamp'].to_numpy(dtype='datetime64[ns]'), result['SoilMoisture'].to_numpy() / 100
+
+def folder_signature(folder, store=False):
+    """
+    Returns the name, size and mtime of every processed file (or of the network store) in a folder,
+    to tell when its data changed.
+    """
+    if store:
+        stat = os.stat(os.path.join(folder, STORE_FILE))
+        return ((STORE_FILE, stat.st_size, stat.st_mtime_ns),)
+    with os.scandir(folder) as entries:
+        return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries
+                            if 'witsms_gpi' in entry.name and os.path.splitext(entry.name)[1] in FILE_EXTENSIONS))
+
+
+class QueryService:
+    """
+    Answers queries on the processed data of one folder, loaded once and shared by all requests.
+    Answers are kept in an LRU cache keyed by the query. A background thread checks the folder
+    every `check_interval` seconds; once its files have changed and then stayed the same for one
+    more check, the data is read again and the cache is emptied. A failed reread is reported and
+    retried on the following checks, the previous data being served meanwhile.
+
+    Args:
+        folder (str): The folder of the processed data, normally the one of the finest resolution.
+        base (str): The resolution of the data in the folder.
+        store (bool): Read the folder's network store instead of the files.
+        cache_size (int): The number of answers kept in the cache.
+        check_interval (float): The seconds between checks of the folder; None disables them.
+
+    The hits and misses attributes count the answers found in and added to the cache.
+    """
+    def __init__(self, folder, base=None, store=False, cache_size=SERVICE_CACHE_SIZE, check_interval=SERVICE_CHECK_INTERVAL):
+        self.folder = folder
+        self.base = base or finest_resolution()
+        self.store = store
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.signature = folder_signature(folder, store)
+        self.data = self._load()
+        if check_interval:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def _load(self):
+        data = SoilMoistureData(self.folder, store=self.store)
+        data.read_data()
+        return data
+
+    def _watch(self):
+        seen = self.signature
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                signature = folder_signature(self.folder, self.store)
+            except OSError:
+                continue
+            if signature != self.signature and signature == seen:
+                try:
+                    data = self._load()
+                except Exception as e:
+                    # e.g. a file removed or half-written while reading; the next check retries
+                    print(f"RELOAD FAILED, STILL SERVING THE PREVIOUS DATA: {type(e).__name__}: {e}")
+                    continue
+                with self._lock:
+                    self.data, self.signature = data, signature
+                    self._cache.clear()
+                print(f"RELOADED {len(data.metadata)} STATIONS FROM {self.folder}")
+            seen = signature
+
+    def answer(self, path, query):
+        """
+        Returns the status, content type and body of the answer to a query, from the cache if it
+        was answered before with the same data.
+
+        Args:
+            path (str): The endpoint, e.g. '/series'.
+            query (dict): The query parameters, one value each.
+        """
+        key = (path, tuple(sorted(query.items())))
+        with self._lock:
+            data = self.data
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+        try:
+            result = self._dispatch(data, path, query)
+        except KeyError as e:
+            return 400, 'application/json', json.dumps({'error': f"Missing parameter {e}"}).encode('utf-8')
+        except (ValueError, TypeError) as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode('utf-8')
+        with self._lock:
+            self.misses += 1
+            if data is self.data:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _dispatch(self, data, path, query):
+        handlers = {'/stations': self.stations, '/series': self.series, '/nearest': self.nearest}
+        if path not in handlers:
+            return 404, 'application/json', json.dumps({'error': f"Unknown endpoint {path}"}).encode('utf-8')
+        as_csv = query.get('format', 'json') == 'csv'
+        if query.get('format', 'json') not in ('json', 'csv'):
+            raise ValueError(f"Unknown format {query['format']}")
+        status, columns, rows, extra = handlers[path](data, query)
+        if as_csv:
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(columns)
+            writer.writerows(rows)
+            return status, 'text/csv', out.getvalue().encode('utf-8')
+        body = dict(extra, **{'columns': columns, 'rows': rows}) if status == 200 else extra
+        return status, 'application/json', json.dumps(body).encode('utf-8')
+
+    def stations(self, data, query):
+        """/stations: the metadata of every station."""
+        columns = ['gpi', 'latitude', 'longitude', 'start_date', 'end_date', 'count', 'overlaps']
+        rows = [[meta[column] for column in columns] for meta in data.metadata]
+        return 200, columns, rows, {}
+
+    def series(self, data, query):
+        """/series?gpi=&start=&end=&resolution=: one station in the window [start, end), averaged to the resolution."""
+        gpi, average = query.get('gpi'), query.get('resolution', self.base)
+        start, end = query.get('start'), query.get('end')
+        # read the base data of the whole intervals whose timestamps fall in the window
+        resolution, base_offset = get_resolution(average), get_resolution(self.base).offset.to_timedelta64()
+        timestamps, soil_moistures = data.get_window(gpi, start and interval_bound(start, resolution) + base_offset,
+                                                     end and interval_bound(end, resolution) + base_offset)
+        if timestamps is None:
+            return 404, [], [], {'error': f"Unknown GPI {gpi}"}
+        timestamps, soil_moistures = resample(timestamps, soil_moistures, average, self.base)
+        rows = [[timestamp, None if np.isnan(value) else value] for timestamp, value
+                in zip(np.datetime_as_string(timestamps, unit='s').tolist(), soil_moistures.tolist())]
+        return 200, ['timestamp', 'soil_moisture'], rows, {'gpi': str(gpi), 'resolution': average}
+
+    def nearest(self, data, query):
+        """/nearest?lat=&lon=&k= or &radius_km=: the stations nearest to a point, nearest first."""
+        lat, lon = float(query['lat']), float(query['lon'])
+        if 'radius_km' in query:
+            found = data.stations_within_radius(lat, lon, float(query['radius_km']))
+        else:
+            found = data.nearest_stations(lat, lon, int(query.get('k', 1)))
+        rows = [[gpi, distance] for gpi, distance in found]
+        return 200, ['gpi', 'distance_km'], rows, {}
+
+def interval_bound(value, resolution):
+    """
+    Returns the start of the first interval of a resolution whose timestamp (its start plus the
+    resolution's offset) is at or after a time, as datetime64[ns].
+    """
+    epoch = np.datetime64(value, 'ns').view('int64') - resolution.offset.value
+    return (epoch + (-epoch) % resolution.freq.value).view('datetime64[ns]')
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Serves GET requests from the QueryService set on the server."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        status, content_type, body = self.server.service.answer(url.path.rstrip('/') or '/', query)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would slow down busy clients; errors are still logged
+        pass
+
+def serve(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    """
+    Serves a QueryService over HTTP on a thread per connection until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"SERVING {len(service.data.metadata)} STATIONS ON http://{host}:{server.server_address[1]}, CTRL+C TO STOP")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("SERVICE STOPPED")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve queries on processed soil moisture data over HTTP.')
+    parser.add_argument('--folder', default=None, help='Folder of processed data to serve; defaults to the finest resolution in OUTDIR')
+    parser.add_argument('--base', default=None, help='Resolution of the data in --folder, e.g. daily; defaults to the finest registered one')
+    parser.add_argument('--host', default=SERVICE_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help='Port to listen on')
+    parser.add_argument('--store', action='store_true', help='Serve the network store of the folder instead of the processed files')
+    parser.add_argument('--cache-size', type=int, default=SERVICE_CACHE_SIZE, help='Number of answers kept in the response cache')
+    args = parser.parse_args()
+
+    base = args.base or finest_resolution()
+    folder = args.folder or os.path.join(OUTDIR, get_resolution(base).folder)
+    serve(QueryService(folder, base, args.store, args.cache_size), args.host, args.port)
@@ -0,0 +1,137 @@
+import heapq
+import numpy as np
+
+# Mean Earth radius in km, used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Maximum number of stations in a leaf of the KD-tree
+LEAF_SIZE = 8
+
+
+def to_unit_vectors(lats, lons):
+    """
+    Converts latitudes and longitudes in degrees to points on the unit sphere. The straight-line
+    (chord) distance between two such points grows with their great-circle distance, so nearest
+    neighbours in 3-D are nearest neighbours on the Earth, with no trouble at the date line.
+    """
+    lat = np.radians(np.asarray(lats, dtype='float64'))
+    lon = np.radians(np.asarray(lons, dtype='float64'))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def chord_to_km(chord):
+    """Converts a chord length on the unit sphere to a great-circle distance in km."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+def km_to_chord(km):
+    """Converts a great-circle distance in km to a chord length on the unit sphere."""
+    return 2 * np.sin(min(km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+class StationIndex:
+    """
+    A KD-tree over station coordinates for nearest-k, radius and bounding-box queries.
+
+    Args:
+        lats: Station latitudes in degrees.
+        lons: Station longitudes in degrees.
+
+    Queries return station positions, i.e. indices into lats and lons, with distances in km.
+    """
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype='float64')
+        self.lons = np.asarray(lons, dtype='float64')
+        self.points = to_unit_vectors(self.lats, self.lons).reshape(-1, 3)
+        # Nodes are (axis, split, left, right) for branches and (None, indices) for leaves
+        self.nodes = []
+        self.root = self._build(np.arange(len(self.points))) if len(self.points) else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, indices):
+        if len(indices) <= LEAF_SIZE:
+            self.nodes.append((None, indices))
+            return len(self.nodes) - 1
+        points = self.points[indices]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        order = np.argsort(points[:, axis], kind='stable')
+        middle = len(indices) // 2
+        split = points[order[middle], axis]
+        node = len(self.nodes)
+        self.nodes.append(None)
+        left = self._build(indices[order[:middle]])
+        right = self._build(indices[order[middle:]])
+        self.nodes[node] = (axis, split, left, right)
+        return node
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Returns the positions and distances in km of the k stations nearest to a point, nearest first.
+        """
+        if self.root is None or k < 1:
+            return np.array([], dtype='int64'), np.array([])
+        target = to_unit_vectors(lat, lon)
+        heap = []  # max-heap of (-squared chord, position) holding the best k so far
+        self._nearest(self.root, target, k, heap)
+        best = sorted((-d, i) for d, i in heap)
+        positions = np.array([i for _, i in best], dtype='int64')
+        return positions, chord_to_km(np.sqrt([d for d, _ in best]))
+
+    def _nearest(self, node, target, k, heap):
+        entry = self.nodes[node]
+        if entry[0] is None:
+            indices = entry[1]
+            distances = ((self.points[indices] - target) ** 2).sum(axis=1)
+            for d, i in zip(distances.tolist(), indices.tolist()):
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d, i))
+                elif d < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d, i))
+            return
+        axis, split, left, right = entry
+        offset = target[axis] - split
+        near, far = (left, right) if offset < 0 else (right, left)
+        self._nearest(near, target, k, heap)
+        # The far side can only hold closer stations if the splitting plane is within the current k-th distance
+        if len(heap) < k or offset * offset < -heap[0][0]:
+            self._nearest(far, target, k, heap)
+
+    def within_radius(self, lat, lon, radius_km):
+        """
+        Returns the positions and distances in km of all stations within radius_km of a point, nearest first.
+        """
+        if self.root is None:
+            return np.array([], dtype='int64'), np.array([])
+        target = to_unit_vectors(lat, lon)
+        limit = km_to_chord(radius_km) ** 2
+        found = []
+        stack = [self.root]
+        while stack:
+            entry = self.nodes[stack.pop()]
+            if entry[0] is None:
+                indices = entry[1]
+                distances = ((self.points[indices] - target) ** 2).sum(axis=1)
+                keep = distances <= limit
+                found.extend(zip(distances[keep].tolist(), indices[keep].tolist()))
+                continue
+            axis, split, left, right = entry
+            offset = target[axis] - split
+            if offset < 0 or offset * offset <= limit:
+                stack.append(left)
+            if offset >= 0 or offset * offset <= limit:
+                stack.append(right)
+        found.sort()
+        positions = np.array([i for _, i in found], dtype='int64')
+        return positions, chord_to_km(np.sqrt([d for d, _ in found]))
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Returns the positions of all stations inside a latitude/longitude box, bounds included.
+        A box with min_lon greater than max_lon is taken to cross the date line.
+        """
+        inside = (self.lats >= min_lat) & (self.lats <= max_lat)
+        if min_lon <= max_lon:
+            inside &= (self.lons >= min_lon) & (self.lons <= max_lon)
+        else:
+            inside &= (self.lons >= min_lon) | (self.lons <= max_lon)
+        return np.flatnonzero(inside)
@@ -0,0 +1,102 @@
+import os
+import json
+import shutil
+import struct
+
+import numpy as np
+
+# File name of the network store in a resolution folder
+STORE_FILE = 'network_store.bin'
+
+# Marks the start and the end of a store file
+MAGIC = b'WITSMS\x00\x01'
+
+# On-disk dtypes: epoch nanoseconds and soil moisture on the 0-1 scale, little-endian
+TIMESTAMP_DTYPE = np.dtype('<M8[ns]')
+VALUE_DTYPE = np.dtype('<f4')
+
+
+def write_store(path, stations):
+    """
+    Packs the series of many stations into one store file:
+
+        MAGIC | timestamps (int64, all stations) | values (float32, all stations) | header | header length | MAGIC
+
+    The JSON header lists every station with its gpi, latitude, longitude, source file name (with
+    its extension), the size and mtime of that file when it was read, and the offset and length of
+    its rows. Stations are streamed to disk one at a time, and the file is replaced atomically. On
+    Linux and macOS, processes that have the old store open keep reading it until they open the
+    new one. On Windows a file that another process has memory-mapped cannot be replaced, and
+    os.replace() raises PermissionError.
+
+    Args:
+        path (str): The path of the store file.
+        stations: An iterable of (name, metadata entry, timestamps, soil moistures, source) per
+                  station, where source is the (size, mtime_ns) of the file the series was read from.
+
+    Returns:
+        int: The number of stations written.
+    """
+    temp_path, values_path = path + '.tmp', path + '.values.tmp'
+    entries = []
+    rows = 0
+    with open(temp_path, 'wb') as f, open(values_path, 'wb') as values_file:
+        f.write(MAGIC)
+        for name, meta, timestamps, values, (size, mtime_ns) in stations:
+            f.write(np.ascontiguousarray(timestamps, dtype=TIMESTAMP_DTYPE).tobytes())
+            values_file.write(np.ascontiguousarray(values, dtype=VALUE_DTYPE).tobytes())
+            entries.append({'gpi': meta['gpi'], 'latitude': meta['latitude'], 'longitude': meta['longitude'],
+                            'name': name, 'size': size, 'mtime_ns': mtime_ns, 'offset': rows, 'length': len(timestamps)})
+            rows += len(timestamps)
+    with open(temp_path, 'ab') as f, open(values_path, 'rb') as values_file:
+        shutil.copyfileobj(values_file, f, 1 << 20)
+        header = json.dumps({'version': 2, 'rows': rows, 'stations': entries}).encode('utf-8')
+        f.write(header)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(MAGIC)
+    os.remove(values_path)
+    os.replace(temp_path, path)
+    return len(entries)
+
+
+class NetworkStore:
+    """
+    A read-only sequence of (timestamps, soil_moistures) per station over a memory-mapped store file.
+    Every item is a pair of views into the mapped arrays: nothing is copied or parsed, pages are
+    read from disk when first touched, and processes opening the same store share them through the
+    OS page cache.
+
+    Args:
+        path (str): The path of the store file, as written by write_store().
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a network store: {path}")
+            f.seek(-(8 + len(MAGIC)), os.SEEK_END)
+            (length,) = struct.unpack('<Q', f.read(8))
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Incomplete network store: {path}")
+            f.seek(-(8 + len(MAGIC) + length), os.SEEK_END)
+            header = json.loads(f.read(length).decode('utf-8'))
+        self.stations = header['stations']
+        rows = header['rows']
+        if rows:
+            self.timestamps = np.memmap(path, dtype=TIMESTAMP_DTYPE, mode='r', offset=len(MAGIC), shape=(rows,))
+            self.values = np.memmap(path, dtype=VALUE_DTYPE, mode='r', offset=len(MAGIC) + rows * TIMESTAMP_DTYPE.itemsize, shape=(rows,))
+        else:
+            self.timestamps = np.empty(0, dtype=TIMESTAMP_DTYPE)
+            self.values = np.empty(0, dtype=VALUE_DTYPE)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __getitem__(self, index):
+        station = self.stations[index]
+        rows = slice(station['offset'], station['offset'] + station['length'])
+        return self.timestamps[rows], self.values[rows]
+
+    def __iter__(self):
+        for index in range(len(self.stations)):
+            yield self[index]
@@ -0,0 +1,78 @@
+import os
+import time
+
+
+class FolderWatcher:
+    """
+    Finds new and changed files in a set of folders by polling, without reading any file.
+    A folder is only listed again when its mtime changes, i.e. when files were added, removed or
+    renamed in it; the files already known are checked with one stat() each, against the size and
+    mtime cached when they were last handed out.
+
+    A file is handed out once it has settled: its size and mtime were the same on two polls in a
+    row and it was last modified at least `settle` seconds ago, so files that a logger export is
+    still writing are left for a later poll.
+
+    Args:
+        folders (list): The folders to watch; folders that do not exist yet are checked on every poll.
+        extension (str): Only files with this extension are watched.
+        settle (float): The seconds a file must be left unmodified before it is handed out.
+    """
+    def __init__(self, folders, extension='.csv', settle=30):
+        self.folders = list(folders)
+        self.extension = extension
+        self.settle = settle
+        self._folder_mtimes = {}  # folder -> mtime when last listed
+        self._listings = {}  # folder -> paths of the watched files in it
+        self._known = {}  # path -> (size, mtime) when last handed out or primed
+        self._seen = {}  # path -> (size, mtime) on the last poll, for files not handed out yet
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _list(self, folder):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            self._folder_mtimes.pop(folder, None)
+            self._listings.pop(folder, None)
+            return []
+        if self._folder_mtimes.get(folder) != mtime:
+            with os.scandir(folder) as entries:
+                self._listings[folder] = sorted(entry.path for entry in entries
+                                                if entry.name.endswith(self.extension) and entry.is_file())
+            self._folder_mtimes[folder] = mtime
+        return self._listings[folder]
+
+    def prime(self):
+        """Records every file present now as known, so that only later changes are handed out."""
+        for folder in self.folders:
+            for path in self._list(folder):
+                signature = self._signature(path)
+                if signature is not None:
+                    self._known[path] = signature
+        self._seen.clear()
+
+    def poll(self):
+        """
+        Returns the paths of the files that are new or changed since they were last handed out
+        and have settled, in folder order.
+        """
+        now = time.time_ns()
+        ready = []
+        for folder in self.folders:
+            for path in self._list(folder):
+                signature = self._signature(path)
+                if signature is None or self._known.get(path) == signature:
+                    self._seen.pop(path, None)
+                    continue
+                previous, self._seen[path] = self._seen.get(path), signature
+                if previous == signature and now - signature[1] >= self.settle * 1e9:
+                    ready.append(path)
+        for path in ready:
+            self._known[path] = self._seen.pop(path)
+        return ready